@@ -0,0 +1,271 @@
+"""
+Tracker loop benchmark with in-process Coinmarketcap, Slack and (optionally) MongoDB.
+
+Runs N markets for M ticks through TrackProduct's start_tracking/process_ticker/finish_tracking
+on a simulated clock and reports samples/sec, per-phase latency, peak RSS and bytes written.
+
+    python benchmarks/bench_tracker.py --markets 20 --ticks 200 --storage-format jsonl --slack
+"""
+
+import argparse
+import configparser
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from coinmarketcap_tracker import SimulatedClock, TrackProduct, configure_logging
+from coinmarketcap_tracker.connections import register_mongo_client
+from coinmarketcap_tracker.fakes import FakePymarketcap, FakeSlackClient, fake_mongo_client
+
+# Method name -> phase name
+timed_methods = {'fetch_ticker': 'fetch', 'persist_ticker': 'persist', 'format_slack_message': 'format',
+                 'send_slack_alert': 'alert', 'process_ticker': 'tick', 'finish_tracking': 'finish'}
+
+
+def instrument(phases):
+    # Wraps TrackProduct methods at class level (send_slack_alert is called through the class) and returns the originals
+    originals = {}
+
+    for method_name, phase in timed_methods.items():
+        original = getattr(TrackProduct, method_name)
+
+        originals[method_name] = original
+
+        def timed(*args, _original=original, _phase=phase, **kwargs):
+            start = time.perf_counter()
+
+            try:
+                return _original(*args, **kwargs)
+
+            finally:
+                phases.setdefault(_phase, []).append(time.perf_counter() - start)
+
+        setattr(TrackProduct, method_name, timed)
+
+    return originals
+
+
+def restore(originals):
+    for method_name, original in originals.items():
+        setattr(TrackProduct, method_name, original)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def process_write_bytes():
+    # Bytes this process caused to be written to storage, where the platform reports it
+    try:
+        with open('/proc/self/io', 'r') as file:
+            for line in file:
+                if line.startswith('write_bytes:'):
+                    return int(line.split()[1])
+
+    except OSError:
+        pass
+
+    return None
+
+
+def directory_size(directory):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, dirs, files in os.walk(directory) for name in files)
+
+
+def write_config(directory):
+    config = configparser.ConfigParser()
+
+    config['slack'] = {'slack_token': 'xoxb-benchmark'}
+    config['settings'] = {'slack_bot_user': 'benchmark', 'slack_bot_icon': ''}
+    config['mongodb'] = {'atlas_user': 'benchmark', 'atlas_pass': 'benchmark', 'uri_atlas': 'benchmark.local/',
+                         'db_name': 'benchmark', 'collection_name': 'runs'}
+
+    config_path = os.path.join(directory, 'benchmark.ini')
+
+    with open(config_path, 'w') as file:
+        config.write(file)
+
+    return config_path
+
+
+def run_benchmark(args):
+    directory = args.directory if args.directory != None else tempfile.mkdtemp(prefix='tracker-bench-')
+
+    config_path = write_config(directory)
+
+    # Trackers and the fake Coinmarketcap share one virtual clock, advanced a loop_time per tick
+    clock = SimulatedClock()
+
+    TrackProduct.cmc_client = FakePymarketcap(update_interval=args.loop_time * args.update_every, seed=args.seed,
+                                              latency=args.fetch_latency, clock=clock)
+
+    # Every request goes to the fake: no caching or rate limiting in front of it
+    TrackProduct.ticker_cache = None
+
+    TrackProduct.request_governor = None
+
+    tracker_options = dict(json_directory=os.path.join(directory, 'json'), loop_time=args.loop_time,
+                           slack_alerts=args.slack, slack_alert_interval=args.slack_alert_interval, config_path=config_path,
+                           mongo=args.mongo, storage_format=args.storage_format, fsync_policy=args.fsync_policy,
+                           mongo_schema=args.mongo_schema, write_behind=args.write_behind,
+                           slack_dispatch=args.slack_dispatch, archive_codec=args.archive_codec, keep_series=False, clock=clock)
+
+    slack_client = FakeSlackClient(channels=['benchmark'], latency=args.slack_latency)
+
+    if args.mongo == True:
+        mongo_client = fake_mongo_client()
+
+    phases = {}
+
+    originals = instrument(phases)
+
+    write_bytes_start = process_write_bytes()
+
+    try:
+        trackers = []
+
+        for market_number in range(args.markets):
+            tracker = TrackProduct(**tracker_options)
+
+            if args.slack == True:
+                tracker.slack_client = slack_client
+
+            if args.mongo == True:
+                register_mongo_client(tracker.url_atlas, mongo_client, **tracker.mongo_pool_options)
+
+            tracker.set_parameters(market='BENCH' + str(market_number) + '/BTC', tracking_duration=args.ticks * args.loop_time / 3600 + 1,
+                                   slack_channel='benchmark')
+
+            tracker.start_tracking()
+
+            trackers.append(tracker)
+
+        # setup requests are not part of the measured loop
+        phases.clear()
+
+        loop_start = time.perf_counter()
+
+        for tick in range(args.ticks):
+            clock.advance(args.loop_time)
+
+            for tracker in trackers:
+                tracker.process_ticker(tracker.fetch_ticker(currency=tracker.trade_product, convert=tracker.quote_product))
+
+        loop_seconds = time.perf_counter() - loop_start
+
+        for tracker in trackers:
+            tracker.finish_tracking()
+
+            if tracker.slack_dispatcher != None:
+                tracker.slack_dispatcher.flush(timeout=60)
+
+        total_seconds = time.perf_counter() - loop_start
+
+    finally:
+        restore(originals)
+
+    write_bytes_end = process_write_bytes()
+
+    samples = args.markets * args.ticks
+
+    report = {'markets': args.markets, 'ticks': args.ticks, 'samples': samples,
+              'loop_seconds': loop_seconds, 'total_seconds': total_seconds,
+              'samples_per_second': samples / loop_seconds if loop_seconds > 0 else None,
+              'updates': sum(tracker.update_count for tracker in trackers),
+              'phases_ms': {}, 'peak_rss_mb': None,
+              'bytes_written': write_bytes_end - write_bytes_start if write_bytes_start != None and write_bytes_end != None else None,
+              'bytes_on_disk': directory_size(os.path.join(directory, 'json')),
+              'slack_messages': slack_client.message_count, 'slack_bytes': slack_client.bytes_posted}
+
+    for phase, durations in phases.items():
+        report['phases_ms'][phase] = {'count': len(durations),
+                                      'mean': sum(durations) / len(durations) * 1000,
+                                      'p50': percentile(durations, 0.50) * 1000,
+                                      'p95': percentile(durations, 0.95) * 1000,
+                                      'p99': percentile(durations, 0.99) * 1000,
+                                      'max': max(durations) * 1000}
+
+    if resource != None:
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        report['peak_rss_mb'] = peak_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+    if args.directory == None and args.keep == False:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return report
+
+
+def print_report(report):
+    print('markets: %s  ticks: %s  samples: %s  updates: %s' % (report['markets'], report['ticks'], report['samples'], report['updates']))
+    print('loop: %.3f s  total (incl. finish): %.3f s  samples/sec: %.1f' % (report['loop_seconds'], report['total_seconds'], report['samples_per_second']))
+
+    if report['peak_rss_mb'] != None:
+        print('peak RSS: %.1f MB' % report['peak_rss_mb'])
+
+    if report['bytes_written'] != None:
+        print('bytes written (process I/O): %s' % report['bytes_written'])
+
+    print('bytes on disk: %s' % report['bytes_on_disk'])
+    print('slack messages: %s (%s bytes)' % (report['slack_messages'], report['slack_bytes']))
+    print()
+    print('%-8s %8s %10s %10s %10s %10s %10s' % ('phase', 'count', 'mean ms', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'))
+
+    for phase in ('fetch', 'tick', 'persist', 'format', 'alert', 'finish'):
+        if phase in report['phases_ms']:
+            stats = report['phases_ms'][phase]
+
+            print('%-8s %8d %10.3f %10.3f %10.3f %10.3f %10.3f' % (phase, stats['count'], stats['mean'], stats['p50'], stats['p95'], stats['p99'], stats['max']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the tracker loop against in-process fakes.')
+
+    parser.add_argument('--markets', type=int, default=10)
+    parser.add_argument('--ticks', type=int, default=100)
+    parser.add_argument('--loop-time', type=int, default=300, help='Simulated seconds per tick')
+    parser.add_argument('--update-every', type=int, default=1, help='Ticks between Coinmarketcap updates of each market')
+    parser.add_argument('--storage-format', choices=('json', 'jsonl'), default='jsonl')
+    parser.add_argument('--fsync-policy', choices=('always', 'group', 'never'), default='always')
+    parser.add_argument('--archive-codec', choices=('gzip', 'zstd', 'auto'), default=None)
+    parser.add_argument('--mongo', action='store_true', help='Persist to mongomock')
+    parser.add_argument('--mongo-schema', choices=('embedded', 'timeseries'), default='embedded')
+    parser.add_argument('--slack', action='store_true', help='Send alerts to a fake Slack client')
+    parser.add_argument('--slack-alert-interval', type=float, default=0, help='Simulated minutes between update alerts')
+    parser.add_argument('--slack-dispatch', action='store_true')
+    parser.add_argument('--write-behind', action='store_true')
+    parser.add_argument('--fetch-latency', type=float, default=0.0, help='Simulated Coinmarketcap latency (seconds)')
+    parser.add_argument('--slack-latency', type=float, default=0.0, help='Simulated Slack latency (seconds)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--directory', default=None, help='Output directory (default: temporary, removed afterwards)')
+    parser.add_argument('--keep', action='store_true', help='Keep the temporary output directory')
+    parser.add_argument('--json', action='store_true', help='Print the report as json')
+
+    args = parser.parse_args(argv)
+
+    configure_logging(level='WARNING')
+
+    report = run_benchmark(args)
+
+    if args.json == True:
+        print(json.dumps(report, indent=4, sort_keys=True))
+
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
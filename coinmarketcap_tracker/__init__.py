@@ -1 +1,7 @@
 from .coinmarketcap_tracker import TrackProduct
+from .pool import TrackerPool
+from .aio import run_trackers
+from .clock import SimulatedClock, SystemClock
+from .logconfig import configure_logging
+from .runarchive import ArchiveReader, ArchiveWriter
+from .metrics import metrics
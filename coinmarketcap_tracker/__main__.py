@@ -0,0 +1,100 @@
+import logging
+import multiprocessing
+from multiprocessing import Process
+
+from .coinmarketcap_tracker import TrackProduct
+from .logconfig import configure_logging, stop_listener
+
+logger = logging.getLogger(__name__)
+
+# Test launcher: python -m coinmarketcap_tracker
+
+
+if __name__ == '__main__':
+    log_listener = configure_logging(level=logging.DEBUG, log_queue=True, logger_names=['__main__'])
+
+    test_config_path = '../../TeslaBot/config/config_tracker.ini'
+
+    test_slack_channel = 'testing'
+
+    #test_slack_channel_id = 'CAX1A4XU1'
+
+    cmc_tracker = TrackProduct(loop_time=30, slack_alerts=True, slack_alert_interval=1,
+                               config_path=test_config_path, heartbeat_monitor=False, mongo=True)
+
+    test_market = 'XLM/BTC'
+
+    # (self, market, tracking_duration, slack_channel=None, slack_thread=None)
+
+    parameter_result = cmc_tracker.set_parameters(market=test_market, tracking_duration=0.15, slack_channel=test_slack_channel)
+    logger.debug('parameter_result: %s', parameter_result)
+
+    try:
+        #cmc_tracker.track_product(load_data=False)
+
+        arguments = tuple()
+
+        keyword_arguments = {'load_data': False}
+
+        tracker_process = Process(target=cmc_tracker.track_product, args=arguments, kwargs=keyword_arguments)
+
+        logger.info('Starting tracker in separate process.')
+
+        tracker_process.start()
+
+        logger.info('Joining process.')
+
+        tracker_process.join()
+
+    except Exception as e:
+        logger.exception('Unhandled exception in main loop.')
+        logger.exception(e)
+
+    except KeyboardInterrupt:
+        logger.info('Exit signal received.')
+
+        #logger.info('Terminating tracker process.')
+
+        #tracker_process.terminate()
+
+        #logger.info('Joining terminated process to ensure clean exit.')
+
+        #tracker_process.join()
+
+    finally:
+        """
+        logger.info('Terminating tracker process.')
+
+        tracker_process.terminate()
+
+        logger.info('Joining terminated process to ensure clean exit.')
+
+        tracker_process.join()
+        """
+
+        if cmc_tracker.heartbeat_monitor == True:
+            logger.info('Disabling heartbeat.')
+
+            cmc_tracker.hb.disable_heartbeat()
+
+        logger.info('Gathering active child processes.')
+
+        active_processes = multiprocessing.active_children()
+
+        logger.info('Terminating all child processes.')
+
+        for proc in active_processes:
+            logger.debug('Child Process: %s', proc)
+
+            proc.terminate()
+
+            logger.info('Joining terminated process to ensure clean exit.')
+
+            proc.join()
+
+        logger.info('Done.')
+
+        if log_listener != None:
+            stop_listener(log_listener)
+
+        #sys.exit()
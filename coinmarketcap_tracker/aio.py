@@ -0,0 +1,59 @@
+import asyncio
+import concurrent.futures
+import functools
+import logging
+
+logger = logging.getLogger(__name__)
+
+# pymarketcap (sync), slackclient 1.x and pymongo are all blocking, so the asyncio mode runs their
+# calls on one shared thread pool. Many markets then share a single event loop and their network
+# round trips overlap instead of each market needing its own process.
+executor_workers = 32
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+
+    if _executor == None:
+        _executor = concurrent.futures.ThreadPoolExecutor(max_workers=executor_workers)
+
+    return _executor
+
+
+def set_executor_workers(max_workers):
+    global _executor, executor_workers
+
+    executor_workers = max_workers
+
+    if _executor != None:
+        _executor.shutdown(wait=False)
+
+        _executor = None
+
+
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_event_loop()
+
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+
+def run_trackers(trackers, load_data=False):
+    # Runs every configured tracker as a coroutine on one event loop until all have finished
+    loop = asyncio.new_event_loop()
+
+    asyncio.set_event_loop(loop)
+
+    try:
+        results = loop.run_until_complete(asyncio.gather(*[tracker.track_product_async(load_data=load_data) for tracker in trackers],
+                                                         return_exceptions=True))
+
+        for tracker, result in zip(trackers, results):
+            if isinstance(result, Exception):
+                logger.error('Tracker for %s exited with exception: %s', tracker.market_name, result)
+
+        return results
+
+    finally:
+        loop.close()
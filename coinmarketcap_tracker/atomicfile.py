@@ -0,0 +1,191 @@
+import atexit
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 'always': fsync the file and its directory before returning
+# 'group': return after the rename and let the shared GroupCommit fsync it with other pending files
+# 'never': leave it to the OS (the rename still means a crash leaves the old or new file, not a truncated one)
+fsync_policies = ('always', 'group', 'never')
+
+
+def check_fsync_policy(fsync):
+    if fsync not in fsync_policies:
+        raise ValueError('Unknown fsync policy "' + str(fsync) + '". Valid policies: ' + ', '.join(fsync_policies))
+
+
+def fsync_directory(directory):
+    # Makes a completed rename durable. Not supported everywhere (e.g. Windows), where it is skipped.
+    try:
+        directory_fd = os.open(directory, os.O_RDONLY)
+
+    except OSError:
+        return
+
+    try:
+        os.fsync(directory_fd)
+
+    except OSError:
+        pass
+
+    finally:
+        os.close(directory_fd)
+
+
+def temp_path_for(path):
+    # Unique per process and thread so concurrent writers never share a temporary file
+    return path + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+
+
+def commit_file(file, temp_path, path, fsync='always'):
+    # Closes a fully written temporary file and renames it over path according to the fsync policy
+    file.flush()
+
+    if fsync == 'always':
+        os.fsync(file.fileno())
+
+    file.close()
+
+    os.replace(temp_path, path)
+
+    if fsync == 'always':
+        fsync_directory(os.path.dirname(path) or '.')
+
+    elif fsync == 'group':
+        get_group_commit().add(path)
+
+
+def discard_file(file, temp_path):
+    file.close()
+
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+
+def atomic_write(path, data, fsync='always'):
+    # Writes data (str or bytes) to a temporary file next to path and renames it over path, so
+    # readers and crash recovery only ever see the complete old or new contents
+    check_fsync_policy(fsync)
+
+    temp_path = temp_path_for(path)
+
+    if isinstance(data, bytes):
+        file = open(temp_path, 'wb')
+
+    else:
+        file = open(temp_path, 'w', encoding='utf-8')
+
+    try:
+        file.write(data)
+
+        commit_file(file, temp_path, path, fsync)
+
+    except BaseException:
+        discard_file(file, temp_path)
+
+        raise
+
+
+class GroupCommit:
+    # Shared fsync for every tracker in the process. Files written with fsync='group' are
+    # collected and fsynced together (each distinct directory once) every interval seconds,
+    # trading a bounded durability window for one batch of fsyncs instead of one per write.
+
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+
+        self.pending = set()
+
+        self.lock = threading.Lock()
+
+        self.thread = None
+
+        self.commit_count = 0
+
+
+    def add(self, path):
+        with self.lock:
+            self.pending.add(path)
+
+            if self.thread == None:
+                self.thread = threading.Thread(target=self.run, name='group-commit', daemon=True)
+
+                self.thread.start()
+
+
+    def commit(self):
+        with self.lock:
+            paths = self.pending
+
+            self.pending = set()
+
+        if len(paths) == 0:
+            return 0
+
+        directories = set()
+
+        for path in paths:
+            try:
+                file_fd = os.open(path, os.O_RDONLY)
+
+                try:
+                    os.fsync(file_fd)
+
+                finally:
+                    os.close(file_fd)
+
+            except OSError as e:
+                # Usually moved or replaced again since it was queued
+                logger.debug('Skipping fsync of %s: %s', path, e)
+
+            directories.add(os.path.dirname(path) or '.')
+
+        for directory in directories:
+            fsync_directory(directory)
+
+        self.commit_count += 1
+
+        logger.debug('Group commit of %s file(s).', len(paths))
+
+        return len(paths)
+
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+
+            self.commit()
+
+
+_group_commit = None
+
+_group_commit_lock = threading.Lock()
+
+
+def get_group_commit():
+    global _group_commit
+
+    with _group_commit_lock:
+        if _group_commit == None:
+            _group_commit = GroupCommit()
+
+            atexit.register(_group_commit.commit)
+
+        return _group_commit
+
+
+def _reset_after_fork():
+    global _group_commit, _group_commit_lock
+
+    # The commit thread does not survive fork. Whatever the parent had pending stays with the parent.
+    _group_commit = None
+
+    _group_commit_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,159 @@
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+from .atomicfile import atomic_write
+from .clock import system_clock
+
+logger = logging.getLogger(__name__)
+
+
+class TickerCache:
+    # TTL-bounded LRU cache of Coinmarketcap ticker responses keyed by (currency, convert).
+    #
+    # Shared by every TrackProduct in the process (TrackProduct.ticker_cache). Concurrent misses on
+    # the same key wait for a single request instead of each going to the network. With
+    # cache_directory set, responses are also written there so trackers in other processes
+    # (e.g. the multiprocessing launcher) can reuse them within the TTL. Entries expire on clock.
+
+
+    def __init__(self, ttl=30, max_entries=512, cache_directory=None, clock=None):
+        self.ttl = ttl
+
+        self.clock = clock if clock != None else system_clock
+
+        self.max_entries = max_entries
+
+        self.cache_directory = cache_directory
+
+        if self.cache_directory != None:
+            if self.cache_directory[-1] != '/':
+                self.cache_directory += '/'
+
+            os.makedirs(self.cache_directory, exist_ok=True)
+
+        self.entries = collections.OrderedDict()    # key -> (expiry time, response)
+
+        self.lock = threading.Lock()
+
+        self.key_locks = {}
+
+        self.hits = 0
+
+        self.misses = 0
+
+
+    def make_key(self, currency, convert):
+        return ((currency or '').upper(), (convert or 'USD').upper())
+
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry != None:
+                if entry[0] > self.clock.time():
+                    self.entries.move_to_end(key)
+
+                    return entry[1]
+
+                del self.entries[key]
+
+        if self.cache_directory != None:
+            return self.get_file(key)
+
+        return None
+
+
+    def set(self, key, response):
+        with self.lock:
+            self.entries[key] = (self.clock.time() + self.ttl, response)
+
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        if self.cache_directory != None:
+            self.set_file(key, response)
+
+
+    def with_clock(self, clock):
+        # Same settings on another clock. The file cache is left out since file mtimes are wall time.
+        return TickerCache(ttl=self.ttl, max_entries=self.max_entries, clock=clock)
+
+
+    def file_path(self, key):
+        return self.cache_directory + key[0] + '_' + key[1] + '.json'
+
+
+    def get_file(self, key):
+        path = self.file_path(key)
+
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+
+            with open(path, 'r', encoding='utf-8') as file:
+                response = json.load(file)
+
+        except (OSError, ValueError):
+            return None
+
+        with self.lock:
+            self.entries[key] = (os.path.getmtime(path) + self.ttl, response)
+
+        return response
+
+
+    def set_file(self, key, response):
+        path = self.file_path(key)
+
+        # Only has to be whole, not durable: a lost entry is just a cache miss
+        try:
+            atomic_write(path, json.dumps(response), fsync='never')
+
+        except OSError as e:
+            logger.warning('Failed to write ticker cache file %s: %s', path, e)
+
+
+    def fetch(self, currency, convert, request):
+        # request: zero-argument callable that performs the actual ticker request on a miss
+        key = self.make_key(currency, convert)
+
+        response = self.get(key)
+
+        if response != None:
+            self.hits += 1
+
+            return response
+
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # Another thread may have filled the entry while this one waited
+            response = self.get(key)
+
+            if response != None:
+                self.hits += 1
+
+                return response
+
+            self.misses += 1
+
+            response = request()
+
+            # Never cache an error response
+            if response.get('metadata', {}).get('error') == None:
+                self.set(key, response)
+
+            return response
+
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
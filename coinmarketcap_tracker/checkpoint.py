@@ -0,0 +1,84 @@
+import json
+import logging
+import os
+import threading
+
+from .atomicfile import atomic_write
+from .clock import system_clock
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    # Small json snapshot of a running tracker (run id, latest ticker, running stats, Mongo
+    # document id, Slack thread ts) so a restarted tracker can pick up where it left off
+    # without re-reading its archive. Written atomically, at most once per interval seconds.
+    # Hold lock while building and saving a state that another thread may also save.
+    version = 1
+
+
+    def __init__(self, path, interval=60, fsync='always', clock=None):
+        self.path = path
+
+        self.clock = clock if clock != None else system_clock
+
+        self.fsync = fsync
+
+        self.interval = interval
+
+        self.saved_last = 0
+
+        self.saved_state = None    # Last state written, so it can be saved again with a field changed
+
+        self.lock = threading.RLock()
+
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                state = json.load(file)
+
+        except (OSError, ValueError):
+            logger.warning('Ignoring unreadable checkpoint %s.', self.path)
+
+            return None
+
+        if state.get('version') != Checkpoint.version:
+            logger.warning('Ignoring checkpoint %s with unsupported version %s.', self.path, state.get('version'))
+
+            return None
+
+        return state
+
+
+    def due(self):
+        return (self.clock.time() - self.saved_last) >= self.interval
+
+
+    def defer(self):
+        # A save has been handed to another thread; not due again until the next interval
+        self.saved_last = self.clock.time()
+
+
+    def save(self, state):
+        state = dict(state, version=Checkpoint.version, saved=self.clock.time())
+
+        with self.lock:
+            atomic_write(self.path, json.dumps(state, sort_keys=True, ensure_ascii=False), fsync=self.fsync)
+
+            self.saved_state = state
+
+        self.saved_last = self.clock.time()
+
+
+    def clear(self):
+        with self.lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+            self.saved_state = None
+
+        self.saved_last = 0
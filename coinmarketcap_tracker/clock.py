@@ -0,0 +1,156 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import threading
+import time
+import weakref
+
+
+class SystemClock:
+    # Real time. Everything in TrackProduct that reads or waits on time goes through a clock so
+    # a SimulatedClock can be swapped in.
+
+
+    def time(self):
+        return time.time()
+
+
+    def monotonic(self):
+        return time.monotonic()
+
+
+    def now(self):
+        return datetime.datetime.now()
+
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+    async def async_sleep(self, seconds):
+        await asyncio.sleep(seconds)
+
+
+    def register(self):
+        pass
+
+
+    def unregister(self):
+        pass
+
+
+class SimulatedClock:
+    # Virtual time that only moves forward when something sleeps on it (or advance() is called),
+    # so a 24 hour tracking run completes as fast as the work itself. time() and monotonic()
+    # return the same virtual timestamp.
+    #
+    # Coroutines sharing one clock on an event loop register() first. async_sleep() then only moves
+    # time forward once every registered coroutine is asleep, and wakes them in deadline order,
+    # so a tracker busy in the executor never has ticks skipped under it.
+
+
+    def __init__(self, start=None):
+        self.current = float(start if start != None else time.time())
+
+        self.lock = threading.Lock()
+
+        self.sleep_count = 0
+
+        self.participants = 0
+
+        self.sleepers = []    # heap of (wake time, sequence, future)
+
+        self.sequence = itertools.count()
+
+
+    def time(self):
+        return self.current
+
+
+    def monotonic(self):
+        return self.current
+
+
+    def now(self):
+        return datetime.datetime.fromtimestamp(self.current)
+
+
+    def advance(self, seconds):
+        with self.lock:
+            if seconds > 0:
+                self.current += seconds
+
+            return self.current
+
+
+    def advance_to(self, timestamp):
+        with self.lock:
+            self.current = max(self.current, timestamp)
+
+            return self.current
+
+
+    def sleep(self, seconds):
+        self.sleep_count += 1
+
+        self.advance(seconds)
+
+
+    def register(self):
+        self.participants += 1
+
+
+    def unregister(self):
+        self.participants -= 1
+
+        self.wake_sleepers()
+
+
+    async def async_sleep(self, seconds):
+        self.sleep_count += 1
+
+        future = asyncio.get_event_loop().create_future()
+
+        heapq.heappush(self.sleepers, (self.current + max(seconds, 0), next(self.sequence), future))
+
+        self.wake_sleepers()
+
+        await future
+
+
+    def wake_sleepers(self):
+        # Event loop thread only
+        if self.sleepers == [] or len(self.sleepers) < self.participants:
+            return
+
+        self.advance_to(self.sleepers[0][0])
+
+        while self.sleepers != [] and self.sleepers[0][0] <= self.current:
+            future = heapq.heappop(self.sleepers)[2]
+
+            if not future.done():
+                future.set_result(None)
+
+
+system_clock = SystemClock()
+
+# Clock-bound copies of shared helpers (TrackProduct.ticker_cache, request_governor): clock -> {id(shared): (shared, copy)}
+_bound_copies = weakref.WeakKeyDictionary()
+
+_bound_lock = threading.Lock()
+
+
+def bind_to_clock(shared, clock):
+    # Returns shared if it already runs on clock, otherwise shared.with_clock(clock), made once per
+    # clock so trackers on the same simulated clock still share one cache and request budget
+    if shared == None or shared.clock is clock:
+        return shared
+
+    with _bound_lock:
+        copies = _bound_copies.setdefault(clock, {})
+
+        if id(shared) not in copies:
+            copies[id(shared)] = (shared, shared.with_clock(clock))
+
+        return copies[id(shared)][1]
@@ -6,14 +6,32 @@ import os
 import shutil
 import sys
 import time
+import uuid
 
 from heartbeatmonitor import Heartbeat
-from pymongo import MongoClient
 from slackclient import SlackClient
 
-#logging.basicConfig()
+from .aio import run_blocking
+from .atomicfile import atomic_write
+from .cache import TickerCache
+from .checkpoint import Checkpoint
+from .clock import bind_to_clock, system_clock
+from .connections import get_mongo_client
+from .formatting import render_quote_message
+from .metrics import metrics, start_metrics_server, start_stats_file
+from .mongo_writer import MongoRunWriter, MongoSampleWriter, ensure_samples_collection
+from .profiling import ProfilingHook
+from .ratelimit import RequestGovernor
+from .runarchive import extension as archive_extension, write_archive
+from .scheduler import AdaptivePoller, TickScheduler
+from .slack_channels import ChannelCache, resolve_channel_id
+from .slack_dispatch import SlackThread, get_dispatcher
+from .stats import RunningStats
+from .storage import open_storage
+from .timeseries import TickerSeries
+from .writebehind import WriteBehindWriter
+
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 
 class TrackProduct:
@@ -21,19 +39,53 @@ class TrackProduct:
 
     cmc_client = Pymarketcap()
 
+    # Shared by all instances. Replace with TickerCache(cache_directory=...) to share across processes, or None to disable.
+    ticker_cache = TickerCache(ttl=30)
+
+    # Token bucket + retry/backoff for every Coinmarketcap request in the process. Sized for the
+    # public API's 30 requests/minute. Pass state_directory to share the budget across processes.
+    request_governor = RequestGovernor(rate=0.5, capacity=10)
+
+    # Slack channel name -> ID cache, created on first use in <json_directory>/slack_channel_cache.json
+    channel_cache = None
+
 
     def __init__(self, json_directory='json/coinmarketcap_tracker/', loop_time=300,
                  slack_alerts=False, slack_alert_interval=60,
                  heartbeat_monitor=False, config_path=None,
-                 mongo=False):
+                 mongo=False, storage_format='json', fsync_records=10, fsync_seconds=60, fsync_policy='always',
+                 mongo_incremental=True, mongo_batch_size=1, mongo_batch_seconds=0,
+                 schedule_jitter=0.0, adaptive_polling=False, poll_min_interval=30, poll_max_interval=None, poll_margin=15,
+                 keep_series=True, mongo_max_pool_size=None, mongo_min_pool_size=None,
+                 write_behind=False, write_behind_records=50, write_behind_seconds=30, write_behind_max_pending=10000,
+                 mongo_schema='embedded', slack_dispatch=False, checkpoint=False, checkpoint_seconds=60,
+                 archive_codec=None, clock=None, metrics_port=None, metrics_file=None, metrics_interval=60,
+                 profiling=False, profile_seconds=60, profile_top=25):
         self.market_name = None
 
+        # Source of time for the loop, deadlines and Slack timing (clock.SimulatedClock runs without waiting)
+        self.clock = clock if clock != None else system_clock
+
+        # The shared cache and governor run on the system clock. On any other clock the tracker uses
+        # copies bound to it (one per clock), so cache expiry and rate limit waits follow that clock.
+        self.ticker_cache = bind_to_clock(TrackProduct.ticker_cache, self.clock)
+
+        self.request_governor = bind_to_clock(TrackProduct.request_governor, self.clock)
+
         self.trade_product = None
 
         self.quote_product = None
 
         self.loop_time = loop_time    # Time (seconds) between checks
 
+        self.schedule_jitter = schedule_jitter    # Fraction of loop_time used to spread tracker start offsets
+
+        self.scheduler = None
+
+        self.adaptive_polling = adaptive_polling    # Poll after Coinmarketcap's learned refresh cadence instead of every loop_time
+
+        self.poll_options = {'min_interval': poll_min_interval, 'max_interval': poll_max_interval, 'margin': poll_margin}
+
         self.json_directory = json_directory
 
         if self.json_directory[-1] != '/':
@@ -42,8 +94,68 @@ class TrackProduct:
         if not os.path.exists(self.json_directory):
             os.makedirs(self.json_directory, exist_ok=True)
 
+        self.storage_format = storage_format    # 'json' (full rewrite per update) or 'jsonl' (append-only)
+
+        self.fsync_policy = fsync_policy    # 'always', 'group' (batched across trackers) or 'never'; applies to every file the tracker writes
+
+        self.storage_options = {'fsync': self.fsync_policy}
+
+        if self.storage_format == 'jsonl':
+            self.storage_options['fsync_records'] = fsync_records
+            self.storage_options['fsync_seconds'] = fsync_seconds
+
+        self.storage = None
+
+        # None moves the finished data file into archive/ as is. 'gzip', 'zstd' or 'auto' (zstd when installed)
+        # converts it to a block-compressed runarchive file instead.
+        self.archive_codec = archive_codec
+
+        self.keep_series = keep_series    # Keep a compact columnar copy of the run in memory (self.market_series)
+
+        self.market_series = None
+
+        self.write_behind = write_behind    # Persist from a background thread instead of inside the polling loop
+
+        self.write_behind_options = {'flush_records': write_behind_records, 'flush_seconds': write_behind_seconds,
+                                     'max_pending': write_behind_max_pending}
+
+        self.write_behind_writer = None
+
+        self.checkpoint = checkpoint    # Periodically checkpoint the run and resume from it after a restart
+
+        self.checkpoint_seconds = checkpoint_seconds
+
+        self.checkpointer = None
+
+        self.run_id = None
+
+        # Per-phase latency histograms and tick counters are always collected (metrics.metrics);
+        # these only choose how they are exported. Both are shared by every tracker in the process,
+        # and started by start_tracking() so they run in the (possibly forked) process doing the work.
+        # A fixed metrics_port is served by the first process that binds it; pass 0 for a free port
+        # per process, or use metrics_file with '{pid}' to get one file per process.
+        self.metrics_port = metrics_port
+
+        self.metrics_file = metrics_file
+
+        self.metrics_interval = metrics_interval
+
+        self.stats_writer = None
+
+        self.skipped_ticks = 0
+
+        # Opt-in: SIGUSR2 or touching <market_directory>/profile.trigger captures a cProfile window and a
+        # tracemalloc snapshot of the running loop into <market_directory>/profiles/
+        self.profiling = profiling
+
+        self.profile_options = {'window_seconds': profile_seconds, 'top_n': profile_top}
+
+        self.profiling_hook = None
+
         config = configparser.ConfigParser()
-        config.read(config_path)
+
+        if config_path != None:
+            config.read(config_path)
 
         self.slack_alerts = slack_alerts
 
@@ -69,6 +181,9 @@ class TrackProduct:
 
                     self.slack_thread = None
 
+                    if TrackProduct.channel_cache == None:
+                        TrackProduct.channel_cache = ChannelCache(cache_file=self.json_directory + 'slack_channel_cache.json')
+
                 except Exception as e:
                     logger.exception('Exception while initializing Slack client. Exiting.')
                     logger.exception(e)
@@ -78,8 +193,21 @@ class TrackProduct:
         else:
             self.slack_client = None
 
+            self.slack_channel_id_tracker = None
+
+            self.slack_thread = None
+
+        # Queue alerts on the process-wide background dispatcher instead of posting inside the loop
+        if self.slack_client != None and slack_dispatch == True:
+            self.slack_dispatcher = get_dispatcher()
+
+        else:
+            self.slack_dispatcher = None
+
         self.mongo = mongo
 
+        self.mongo_writer = None
+
         if self.mongo == True:
             atlas_user = config['mongodb']['atlas_user']
             atlas_pass = config['mongodb']['atlas_pass']
@@ -95,6 +223,19 @@ class TrackProduct:
 
             self.mongo_doc = {}
 
+            self.mongo_incremental = mongo_incremental    # Push new tickers instead of rewriting the whole document
+
+            self.mongo_batch_size = mongo_batch_size
+
+            self.mongo_batch_seconds = mongo_batch_seconds
+
+            self.mongo_pool_options = {'max_pool_size': mongo_max_pool_size, 'min_pool_size': mongo_min_pool_size}
+
+            # 'embedded': tickers in the run document's results.data, 'timeseries': one document per ticker in a samples collection
+            self.mongo_schema = mongo_schema
+
+            self.samples_collection_name = config['mongodb'].get('samples_collection_name', self.collection_name + '_samples')
+
         self.heartbeat_monitor = heartbeat_monitor
 
         if self.heartbeat_monitor == True:
@@ -125,7 +266,7 @@ class TrackProduct:
 
 
     def set_parameters(self, market, tracking_duration, slack_channel=None, slack_channel_id=None, slack_thread=None,
-                       dedicated_channel=True, analysis_parameters=None):
+                       dedicated_channel=True, analysis_parameters=None, validate_market=True):
         self.market_name = market
 
         self.trade_product = market.split('/')[0].upper()
@@ -142,25 +283,27 @@ class TrackProduct:
 
         #self.analysis_parameters = analysis_parameters
 
-        try:
-            TrackProduct.cmc_client.ticker(currency=self.trade_product)
+        # Replays (see replay.py) skip the check, since their data does not come from Coinmarketcap
+        if validate_market == True:
+            try:
+                self.fetch_ticker(currency=self.trade_product)
 
-        except Exception as e:
-            logger.exception('Unhandled exception while retrieving Coinmarketcap data for ' + self.trade_product + '.')
-            logger.exception(e)
+            except Exception as e:
+                logger.exception('Unhandled exception while retrieving Coinmarketcap data for %s.', self.trade_product)
+                logger.exception(e)
 
-            return False
+                return False
 
-        try:
-            TrackProduct.cmc_client.ticker(currency=self.trade_product, convert=self.quote_product)
+            try:
+                self.fetch_ticker(currency=self.trade_product, convert=self.quote_product)
 
-        except Exception as e:
-            logger.exception('Unhandled exception while converting Coinmarketcap ticker data using quote product ' + self.quote_product + '.')
-            logger.exception(e)
+            except Exception as e:
+                logger.exception('Unhandled exception while converting Coinmarketcap ticker data using quote product %s.', self.quote_product)
+                logger.exception(e)
 
-            return False
+                return False
 
-        dt_start = datetime.datetime.now()
+        dt_start = self.clock.now()
 
         self.track_end_time = dt_start + datetime.timedelta(hours=tracking_duration)
 
@@ -182,7 +325,17 @@ class TrackProduct:
 
             os.makedirs(self.market_directory, exist_ok=True)
 
-        self.cmc_data_file = self.market_directory + 'historical_data.json'
+        self.storage = open_storage(self.market_directory + 'historical_data', storage_format=self.storage_format, **self.storage_options)
+
+        self.cmc_data_file = self.storage.path
+
+        if self.checkpoint == True:
+            self.checkpointer = Checkpoint(self.market_directory + 'checkpoint.json', interval=self.checkpoint_seconds, fsync=self.fsync_policy,
+                                           clock=self.clock)
+
+        if self.profiling == True:
+            self.profiling_hook = ProfilingHook(self.market_directory + 'profiles/', trigger_file=self.market_directory + 'profile.trigger',
+                                                state=self.profile_state, **self.profile_options)
 
         self.archive_directory = self.market_directory + 'archive/'
 
@@ -191,64 +344,13 @@ class TrackProduct:
             os.makedirs(self.archive_directory, exist_ok=True)
 
         if self.slack_client != None:
-            channel_list = self.slack_client.api_call('channels.list')
-            logger.debug('channel_list: ' + str(channel_list))
-
-            group_list = self.slack_client.api_call('groups.list')
-            logger.debug('group_list: ' + str(group_list))
-
             if slack_channel_id == None:
-                #self.slack_channel_tracker = slack_channel
-
-                #slack_channel_targets = {'tracker': self.slack_channel_tracker}
-                slack_channel_targets = {'tracker': self.slack_channel}
-
-                for target in slack_channel_targets:
-                    try:
-                        logger.debug('channel_list.get(\'ok\'): ' + str(channel_list.get('ok')))
-                        if channel_list.get('ok'):
-                            for chan in channel_list['channels']:
-                                logger.debug('chan[\'name\']: ' + chan['name'])
-                                if chan['name'] == slack_channel_targets[target]:
-                                    if target == 'tracker':
-                                        slack_channel_id_tracker = chan['id']
-
-                                    elif target == 'exceptions':
-                                        slack_channel_id_exceptions = chan['id']
-
-                                    break
-                            else:
-                                logger.error('No valid Slack channel found for alert in channel list.')
-
-                                sys.exit(1)
-
-                        else:
-                            logger.error('Channel list API call failed.')
-
-                            sys.exit(1)
-
-                    except:
-                        logger.debug('group_list.get(\'ok\'): ' + str(group_list.get('ok')))
-                        if group_list.get('ok'):
-                            for group in group_list['groups']:
-                                logger.debug('group[\'name\']: ' + group['name'])
-                                if group['name'] == slack_channel_targets[target]:
-                                    if target == 'tracker':
-                                        slack_channel_id_tracker = group['id']
+                slack_channel_id_tracker = resolve_channel_id(self.slack_client, self.slack_channel, TrackProduct.channel_cache)
 
-                                    elif target == 'exceptions':
-                                        slack_channel_id_exceptions = group['id']
+                if slack_channel_id_tracker == None:
+                    logger.error('No valid Slack channel found for alert.')
 
-                                    break
-                            else:
-                                logger.error('No valid Slack channel found for alert in group list.')
-
-                                sys.exit(1)
-
-                        else:
-                            logger.error('Group list API call failed.')
-
-                            sys.exit(1)
+                    sys.exit(1)
 
                 self.slack_channel_id_tracker = slack_channel_id_tracker
 
@@ -257,8 +359,7 @@ class TrackProduct:
 
             #logger.info('Slack channel for tracker alerts: #' + self.slack_channel_tracker +
                         #' (' + self.slack_channel_id_tracker + ')')
-            logger.info('Slack channel for tracker alerts: #' + str(self.slack_channel) +
-                        ' (' + str(self.slack_channel_id_tracker) + ')')
+            logger.info('Slack channel for tracker alerts: #%s (%s)', self.slack_channel, self.slack_channel_id_tracker)
 
             if self.dedicated_channel == False:
                 self.slack_thread = slack_thread
@@ -269,386 +370,373 @@ class TrackProduct:
         return True
 
 
-    def send_slack_alert(self, channel_id, message, thread_id=None, broadcast=False):
-        alert_return = {'Exception': False, 'result': None}
-
-        try:
-            alert_return['result'] = self.slack_client.api_call(
-                'chat.postMessage',
-                channel=channel_id,
-                text=message,
-                username=self.slack_bot_user,
-                icon_url=self.slack_bot_icon,
-                thread_ts=thread_id,
-                #reply_broadcast=True
-                thread_broadcast=broadcast
-            )
+    def fetch_ticker(self, currency=None, convert=None):
+        ticker_args = {'currency': currency}
 
-        except Exception as e:
-            logger.exception('Exception while sending Slack alert.')
-            logger.exception(e)
+        if convert != None:
+            ticker_args['convert'] = convert
 
-            alert_return['Exception'] = True
-
-        finally:
-            return alert_return
-
-
-    def track_product(self, load_data=False):
-        def format_slack_message(input_data, message_type):
-            message_formatted = ''
-
-            try:
-                if message_type == 'quote':
-                    dt_timestamp = datetime.datetime.fromtimestamp(input_data['metadata']['timestamp'])#.isoformat(sep=' ', timespec='seconds')
-                    logger.debug('dt_timestamp: ' + str(dt_timestamp))
+        def ticker(**kwargs):
+            # Only the Coinmarketcap call itself; governor waits and backoff are measured separately
+            with metrics.timer('tracker_fetch_seconds', market=str(self.market_name)):
+                return TrackProduct.cmc_client.ticker(**kwargs)
 
-                    dt_header = dt_timestamp.strftime('%m-%d-%y %H:%M:%S')
+        def request():
+            if self.request_governor != None:
+                return self.request_governor.call('ticker', ticker, **ticker_args)
 
-                    message_formatted += '*_' + dt_header + ' - ' + self.market_name + '_*\n'
+            return ticker(**ticker_args)
 
-                    quotes_last = input_data['data']['quotes'][self.quote_product]
+        if self.ticker_cache != None:
+            return self.ticker_cache.fetch(currency, convert, request)
 
-                    for quote in quotes_last:
-                        quote_title_words = quote.split('_')
+        return request()
 
-                        quote_title = ''
 
-                        for word in quote_title_words:
-                          if word[0].isnumeric():
-                              word_modified = '(' + word + ')'
+    def send_slack_alert(self, channel_id, message, thread_id=None, broadcast=False, coalesce=False, on_result=None):
+        alert_return = {'Exception': False, 'result': None}
 
-                          else:
-                              word_modified = word.capitalize()
+        if self.slack_client == None:
+            logger.debug('Slack alerts disabled. Skipping alert.')
 
-                          #quote_title += word.capitalize() + ' '
-                          quote_title += word_modified + ' '
+            return alert_return
 
-                        quote_title = quote_title.rstrip(' ')
+        if self.slack_dispatcher != None:
+            # Result arrives later through on_result
+            self.slack_dispatcher.submit(self.slack_client, channel_id, message, thread=thread_id, coalesce=coalesce,
+                                         source=self.market_name, on_result=on_result,
+                                         username=self.slack_bot_user, icon_url=self.slack_bot_icon, thread_broadcast=broadcast)
 
-                        message_line = '*' + quote_title + ':* '# + quotes_last[quote]
+            return alert_return
 
-                        if 'Volume' in quote_title:
-                          if self.quote_product == 'USD':
-                              message_line += '$' + "{:.2f}".format(quotes_last[quote])
+        try:
+            with metrics.timer('tracker_slack_post_seconds', channel=channel_id):
+                alert_return['result'] = self.slack_client.api_call(
+                    'chat.postMessage',
+                    channel=channel_id,
+                    text=message,
+                    username=self.slack_bot_user,
+                    icon_url=self.slack_bot_icon,
+                    thread_ts=thread_id,
+                    #reply_broadcast=True
+                    thread_broadcast=broadcast
+                )
 
-                          else:
-                              message_line += "{:.2f}".format(quotes_last[quote]) + ' ' + self.quote_product
+        except Exception as e:
+            logger.exception('Exception while sending Slack alert.')
+            logger.exception(e)
 
-                        elif quote_title == 'Price':
-                          if self.quote_product == 'USD':
-                              message_line += '$'
+            alert_return['Exception'] = True
 
-                              if quotes_last[quote] < 1:
-                                  message_line += "{:.4f}".format(quotes_last[quote])
-                              else:
-                                  message_line += "{:.2f}".format(quotes_last[quote])
+        finally:
+            return alert_return
 
-                          else:
-                              message_line += "{:.8f}".format(quotes_last[quote]) + ' ' + self.quote_product
 
-                        elif 'Percent' in quote_title:
-                          message_line += "{:.2f}".format(quotes_last[quote]) + '%'
+    def format_slack_message(self, input_data, message_type):
+        message_formatted = ''
 
-                        elif quote_title == 'Market Cap':
-                          if self.quote_product == 'USD':
-                              message_line += '$' + "{:.2f}".format(quotes_last[quote])
+        try:
+            if message_type == 'quote':
+                # Compiled template per (quote product, quote keys), see formatting.py
+                message_formatted = render_quote_message(self.market_name, self.quote_product, input_data)
 
-                          else:
-                              message_line += "{:.2f}".format(quotes_last[quote]) + ' ' + self.quote_product
+            elif message_type == 'final':
+                dt_current = self.clock.now()
+                logger.debug('dt_current: %s', dt_current)
 
-                        else:
-                          logger.warning('Unknown quote message type.')
+                dt_header = dt_current.strftime('%m-%d-%y %H:%M:%S')
+                logger.debug('dt_header: %s', dt_header)
 
-                          logger.warning('quote: ' + quote)
+                message_formatted += '*_' + dt_header + ' - ' + self.market_name + '_*\n'
 
-                          logger.warning('quote_title: ' + quote_title)
+                ## Tracking duration ##
+                #message_formatted += '*Tracking Duration:* ' + "{:.2f}".format(input_data['duration_minutes']) + ' hours\n'
+                #message_formatted += '*Tracking Duration:* ' + str(round(input_data['duration_minutes'], 2)) + ' hours\n'
+                message_formatted += '*Tracking Duration:* ' + input_data['duration_string'] + '\n'
 
-                        message_line += '\n'
+                ## Price change ##
+                message_formatted += '*Price Change:* '
 
-                        message_formatted += message_line
+                if self.quote_product == 'USD':
+                    #message_formatted += '$' + "{:.2f}".format(input_data['price_first']) + ' ---> $' + "{:.2f}".format(input_data['price_last']) + ' _('
+                    message_formatted += "{:.2f}".format(input_data['price_first']) + ' --> $' + "{:.2f}".format(input_data['price_last']) + ' _('
 
-                    message_formatted = message_formatted.rstrip('\n')
+                    if input_data['price_difference'] > 0:
+                        message_formatted += '+'
 
-                elif message_type == 'final':
-                    dt_current = datetime.datetime.now()
-                    logger.debug('dt_current: ' + str(dt_current))
+                    elif input_data['price_difference'] < 0:
+                        message_formatted += '-'
 
-                    dt_header = dt_current.strftime('%m-%d-%y %H:%M:%S')
-                    logger.debug('dt_header: ' + str(dt_header))
+                        input_data['price_difference'] = abs(input_data['price_difference'])
 
-                    message_formatted += '*_' + dt_header + ' - ' + self.market_name + '_*\n'
+                    else:
+                        pass    # Nothing required
 
-                    ## Tracking duration ##
-                    #message_formatted += '*Tracking Duration:* ' + "{:.2f}".format(input_data['duration_minutes']) + ' hours\n'
-                    #message_formatted += '*Tracking Duration:* ' + str(round(input_data['duration_minutes'], 2)) + ' hours\n'
-                    message_formatted += '*Tracking Duration:* ' + input_data['duration_string'] + '\n'
+                    #message_formatted += '$' + "{:.2f}".format(input_data['price_difference']) + ' || '
+                    message_formatted += "{:.2f}".format(input_data['price_difference']) + ' || '
 
-                    ## Price change ##
-                    message_formatted += '*Price Change:* '
+                else:
+                    #message_formatted += ("{:.8f}".format(input_data['price_first']) + ' ' + self.quote_product + '/' + self.trade_product + ' ---> ' +
+                                          #"{:.8f}".format(input_data['price_last']) + ' ' + self.quote_product + '/' + self.trade_product + ' _(')
+                    message_formatted += ("{:.8f}".format(input_data['price_first']) + ' --> ' +
+                                          "{:.8f}".format(input_data['price_last']) + ' ' + self.quote_product + '/' + self.trade_product + ' _(')
 
-                    if self.quote_product == 'USD':
-                        #message_formatted += '$' + "{:.2f}".format(input_data['price_first']) + ' ---> $' + "{:.2f}".format(input_data['price_last']) + ' _('
-                        message_formatted += "{:.2f}".format(input_data['price_first']) + ' --> $' + "{:.2f}".format(input_data['price_last']) + ' _('
+                    if input_data['price_difference'] > 0:
+                        message_formatted += '+'
 
-                        if input_data['price_difference'] > 0:
-                            message_formatted += '+'
+                    elif input_data['price_difference'] < 0:
+                        message_formatted += '-'
 
-                        elif input_data['price_difference'] < 0:
-                            message_formatted += '-'
+                        input_data['price_difference'] = abs(input_data['price_difference'])
 
-                            input_data['price_difference'] = abs(input_data['price_difference'])
+                    else:
+                        pass    # Nothing required
 
-                        else:
-                            pass    # Nothing required
+                    #message_formatted += "{:.8f}".format(input_data['price_difference']) + ' ' + self.quote_product + '/' + self.trade_product + ' || '
+                    message_formatted += "{:.8f}".format(input_data['price_difference']) + ' || '
 
-                        #message_formatted += '$' + "{:.2f}".format(input_data['price_difference']) + ' || '
-                        message_formatted += "{:.2f}".format(input_data['price_difference']) + ' || '
+                if input_data['price_percent_difference'] > 0:
+                    message_formatted += '+'
 
-                    else:
-                        #message_formatted += ("{:.8f}".format(input_data['price_first']) + ' ' + self.quote_product + '/' + self.trade_product + ' ---> ' +
-                                              #"{:.8f}".format(input_data['price_last']) + ' ' + self.quote_product + '/' + self.trade_product + ' _(')
-                        message_formatted += ("{:.8f}".format(input_data['price_first']) + ' --> ' +
-                                              "{:.8f}".format(input_data['price_last']) + ' ' + self.quote_product + '/' + self.trade_product + ' _(')
+                elif input_data['price_percent_difference'] < 0:
+                    message_formatted += '-'
 
-                        if input_data['price_difference'] > 0:
-                            message_formatted += '+'
+                    input_data['price_percent_difference'] = abs(input_data['price_percent_difference'])
 
-                        elif input_data['price_difference'] < 0:
-                            message_formatted += '-'
+                else:
+                    pass    # Nothing required
 
-                            input_data['price_difference'] = abs(input_data['price_difference'])
+                message_formatted += "{:.2f}".format(input_data['price_percent_difference']) + '%)_\n'
 
-                        else:
-                            pass    # Nothing required
+                ## Marketcap change ##
+                message_formatted += '*Market Cap Change:* '
 
-                        #message_formatted += "{:.8f}".format(input_data['price_difference']) + ' ' + self.quote_product + '/' + self.trade_product + ' || '
-                        message_formatted += "{:.8f}".format(input_data['price_difference']) + ' || '
+                if self.quote_product == 'USD':
+                    #message_formatted += '$' + "{:.2f}".format(input_data['marketcap_first']) + ' ---> $' + "{:.2f}".format(input_data['marketcap_last']) + ' _('
+                    message_formatted += "{:.2f}".format(input_data['marketcap_first']) + ' --> $' + "{:.2f}".format(input_data['marketcap_last']) + ' _('
 
-                    if input_data['price_percent_difference'] > 0:
+                    if input_data['marketcap_difference'] > 0:
                         message_formatted += '+'
 
-                    elif input_data['price_percent_difference'] < 0:
+                    elif input_data['marketcap_difference'] < 0:
                         message_formatted += '-'
 
-                        input_data['price_percent_difference'] = abs(input_data['price_percent_difference'])
+                        input_data['marketcap_difference'] = abs(input_data['marketcap_difference'])
 
                     else:
                         pass    # Nothing required
 
-                    message_formatted += "{:.2f}".format(input_data['price_percent_difference']) + '%)_\n'
+                    #message_formatted += '$' + "{:.2f}".format(input_data['marketcap_difference']) + ' || '
+                    message_formatted += "{:.2f}".format(input_data['marketcap_difference']) + ' || '
 
-                    ## Marketcap change ##
-                    message_formatted += '*Market Cap Change:* '
+                else:
+                    #message_formatted += ("{:.2f}".format(input_data['marketcap_first']) + ' ' + self.quote_product + ' ---> ' +
+                                          #"{:.2f}".format(input_data['marketcap_last']) + ' ' + self.quote_product + ' _(')
+                    message_formatted += ("{:.2f}".format(input_data['marketcap_first']) + ' --> ' +
+                                          "{:.2f}".format(input_data['marketcap_last']) + ' ' + self.quote_product + ' _(')
 
-                    if self.quote_product == 'USD':
-                        #message_formatted += '$' + "{:.2f}".format(input_data['marketcap_first']) + ' ---> $' + "{:.2f}".format(input_data['marketcap_last']) + ' _('
-                        message_formatted += "{:.2f}".format(input_data['marketcap_first']) + ' --> $' + "{:.2f}".format(input_data['marketcap_last']) + ' _('
+                    if input_data['marketcap_difference'] > 0:
+                        message_formatted += '+'
 
-                        if input_data['marketcap_difference'] > 0:
-                            message_formatted += '+'
+                    elif input_data['marketcap_difference'] < 0:
+                        message_formatted += '-'
 
-                        elif input_data['marketcap_difference'] < 0:
-                            message_formatted += '-'
+                        input_data['marketcap_difference'] = abs(input_data['marketcap_difference'])
 
-                            input_data['marketcap_difference'] = abs(input_data['marketcap_difference'])
+                    else:
+                        pass    # Nothing required
 
-                        else:
-                            pass    # Nothing required
+                    #message_formatted += "{:.2f}".format(input_data['marketcap_difference']) + ' ' + self.quote_product + ' || '
+                    message_formatted += "{:.2f}".format(input_data['marketcap_difference']) + ' || '
 
-                        #message_formatted += '$' + "{:.2f}".format(input_data['marketcap_difference']) + ' || '
-                        message_formatted += "{:.2f}".format(input_data['marketcap_difference']) + ' || '
+                if input_data['marketcap_percent_difference'] > 0:
+                    message_formatted += '+'
 
-                    else:
-                        #message_formatted += ("{:.2f}".format(input_data['marketcap_first']) + ' ' + self.quote_product + ' ---> ' +
-                                              #"{:.2f}".format(input_data['marketcap_last']) + ' ' + self.quote_product + ' _(')
-                        message_formatted += ("{:.2f}".format(input_data['marketcap_first']) + ' --> ' +
-                                              "{:.2f}".format(input_data['marketcap_last']) + ' ' + self.quote_product + ' _(')
+                elif input_data['marketcap_percent_difference'] < 0:
+                    message_formatted += '-'
 
-                        if input_data['marketcap_difference'] > 0:
-                            message_formatted += '+'
+                    input_data['marketcap_percent_difference'] = abs(input_data['marketcap_percent_difference'])
 
-                        elif input_data['marketcap_difference'] < 0:
-                            message_formatted += '-'
+                else:
+                    pass
 
-                            input_data['marketcap_difference'] = abs(input_data['marketcap_difference'])
+                message_formatted += "{:.2f}".format(input_data['marketcap_percent_difference']) + '%)_\n'
 
-                        else:
-                            pass    # Nothing required
+                ## Rank change ##
+                message_formatted += '*Rank Change:* #' + "{:.0f}".format(input_data['rank_first']) + ' --> #' + "{:.0f}".format(input_data['rank_last']) + ' _('
 
-                        #message_formatted += "{:.2f}".format(input_data['marketcap_difference']) + ' ' + self.quote_product + ' || '
-                        message_formatted += "{:.2f}".format(input_data['marketcap_difference']) + ' || '
+                if input_data['rank_difference'] == 0:
+                    message_formatted += 'No Change'
 
-                    if input_data['marketcap_percent_difference'] > 0:
+                else:
+                    if input_data['rank_difference'] > 0:
                         message_formatted += '+'
 
-                    elif input_data['marketcap_percent_difference'] < 0:
-                        message_formatted += '-'
+                    message_formatted += "{:.0f}".format(input_data['rank_difference'])
 
-                        input_data['marketcap_percent_difference'] = abs(input_data['marketcap_percent_difference'])
+                message_formatted += ')_'
 
-                    else:
-                        pass
+            else:
+                logger.error('Unrecognized message type in format_slack_message().')
 
-                    message_formatted += "{:.2f}".format(input_data['marketcap_percent_difference']) + '%)_\n'
+        except Exception as e:
+            logger.exception('Exception while formatting quote data.')
+            logger.exception(e)
 
-                    ## Rank change ##
-                    message_formatted += '*Rank Change:* #' + "{:.0f}".format(input_data['rank_first']) + ' --> #' + "{:.0f}".format(input_data['rank_last']) + ' _('
+        finally:
+            return message_formatted
 
-                    if input_data['rank_difference'] == 0:
-                        message_formatted += 'No Change'
 
-                    else:
-                        if input_data['rank_difference'] > 0:
-                            message_formatted += '+'
+    def prepare_results(self, data_list=None):
+        # Uses the running accumulator; data_list is only needed when results are computed after the fact
+        results = {'Exception': False,'result': {}}
 
-                        message_formatted += "{:.0f}".format(input_data['rank_difference'])
+        try:
+            if data_list != None:
+                market_stats = RunningStats(self.quote_product)
 
-                    message_formatted += ')_'
+                for cmc_data in data_list:
+                    market_stats.update(cmc_data)
 
-                else:
-                    logger.error('Unrecognized message type in format_slack_message().')
+            else:
+                market_stats = self.market_stats
 
-            except Exception as e:
-                logger.exception('Exception while formatting quote data.')
-                logger.exception(e)
+            ## Duration, price, market cap, rank ##
 
-            finally:
-                return message_formatted
+            # Timestamp data
+            timestamp_last = market_stats.timestamp_last
+            logger.debug('timestamp_last: %s', timestamp_last)
 
+            timestamp_first = market_stats.timestamp_first
+            logger.debug('timestamp_first: %s', timestamp_first)
 
-        def prepare_results(data_list):
-            results = {'Exception': False,'result': {}}
+            # Calculate duration from timestamps
+            timestamp_delta = datetime.datetime.fromtimestamp(timestamp_last) - datetime.datetime.fromtimestamp(timestamp_first)
+            logger.debug('timestamp_delta: %s', timestamp_delta)
 
-            try:
-                ## Duration, price, market cap, rank ##
+            #duration_hours = timestamp_delta / datetime.timedelta(hours=1)
+            duration_minutes = timestamp_delta / datetime.timedelta(minutes=1)
+            logger.debug('duration_minutes: %s', duration_minutes)
 
-                # Timestamp data
-                timestamp_last = data_list[-1]['metadata']['timestamp']
-                logger.debug('timestamp_last: ' + str(timestamp_last))
+            hour_count = int(duration_minutes / 60)
+            minute_count = duration_minutes % 60
 
-                timestamp_first = data_list[0]['metadata']['timestamp']
-                logger.debug('timestamp_first: ' + str(timestamp_first))
+            duration_string = str(hour_count) + 'hour'
 
-                # Calculate duration from timestamps
-                timestamp_delta = datetime.datetime.fromtimestamp(timestamp_last) - datetime.datetime.fromtimestamp(timestamp_first)
-                logger.debug('timestamp_delta: ' + str(timestamp_delta))
+            if hour_count == 0 or hour_count > 1:
+                duration_string += 's'
 
-                #duration_hours = timestamp_delta / datetime.timedelta(hours=1)
-                duration_minutes = timestamp_delta / datetime.timedelta(minutes=1)
-                logger.debug('duration_minutes: ' + str(duration_minutes))
+            duration_string += ' ' + "{:.2f}".format(minute_count) + 'minute'
 
-                hour_count = int(duration_minutes / 60)
-                minute_count = duration_minutes % 60
+            if minute_count != 1:
+                duration_string += 's'
 
-                duration_string = str(hour_count) + 'hour'
+            logger.debug('duration_string: %s', duration_string)
 
-                if hour_count == 0 or hour_count > 1:
-                    duration_string += 's'
+            # Price data
+            price_first = market_stats.price_first
+            logger.debug('price_first: %s', price_first)
 
-                duration_string += ' ' + "{:.2f}".format(minute_count) + 'minute'
+            price_last = market_stats.price_last
+            logger.debug('price_last: %s', price_last)
 
-                if minute_count != 1:
-                    duration_string += 's'
+            price_difference = price_last - price_first
+            logger.debug('price_difference: %s', price_difference)
 
-                logger.debug('duration_string: ' + duration_string)
+            price_percent_difference = (price_difference / price_first) * 100
+            logger.debug('price_percent_difference: %s', price_percent_difference)
 
-                # Price data
-                price_first = data_list[0]['data']['quotes'][self.quote_product]['price']
-                logger.debug('price_first: ' + str(price_first))
+            # Market cap data
+            marketcap_first = market_stats.marketcap_first
+            logger.debug('marketcap_first: %s', marketcap_first)
 
-                price_last = data_list[-1]['data']['quotes'][self.quote_product]['price']
-                logger.debug('price_last: ' + str(price_last))
+            marketcap_last = market_stats.marketcap_last
+            logger.debug('marketcap_last: %s', marketcap_last)
 
-                price_difference = price_last - price_first
-                logger.debug('price_difference: ' + str(price_difference))
+            marketcap_difference = marketcap_last - marketcap_first
+            logger.debug('marketcap_difference: %s', marketcap_difference)
 
-                price_percent_difference = (price_difference / price_first) * 100
-                logger.debug('price_percent_difference: ' + str(price_percent_difference))
+            marketcap_percent_difference = (marketcap_difference / marketcap_first) * 100
+            logger.debug('marketcap_percent_difference: %s', marketcap_percent_difference)
 
-                # Market cap data
-                marketcap_first = data_list[0]['data']['quotes'][self.quote_product]['market_cap']
-                logger.debug('marketcap_first: ' + str(marketcap_first))
+            # Ranking data
+            rank_first = market_stats.rank_first
+            logger.debug('rank_first: %s', rank_first)
 
-                marketcap_last = data_list[-1]['data']['quotes'][self.quote_product]['market_cap']
-                logger.debug('marketcap_last: ' + str(marketcap_last))
+            rank_last = market_stats.rank_last
+            logger.debug('rank_last: %s', rank_last)
 
-                marketcap_difference = marketcap_last - marketcap_first
-                logger.debug('marketcap_difference: ' + str(marketcap_difference))
+            #rank_difference = rank_last - rank_first
+            rank_difference = rank_first - rank_last
+            logger.debug('rank_difference: %s', rank_difference)
 
-                marketcap_percent_difference = (marketcap_difference / marketcap_first) * 100
-                logger.debug('marketcap_percent_difference: ' + str(marketcap_percent_difference))
+            results['result'] = dict(price_first=price_first, price_last=price_last, price_difference=price_difference,
+                                     price_percent_difference=price_percent_difference,
+                                     marketcap_first=marketcap_first, marketcap_last=marketcap_last, marketcap_difference=marketcap_difference,
+                                     marketcap_percent_difference=marketcap_percent_difference,
+                                     rank_first=rank_first, rank_last=rank_last, rank_difference=rank_difference,
+                                     timestamp_first=timestamp_first, timestamp_last=timestamp_last, timestamp_delta=timestamp_delta,
+                                     duration_minutes=duration_minutes, duration_string=duration_string)
 
-                # Ranking data
-                rank_first = data_list[0]['data']['rank']
-                logger.debug('rank_first: ' + str(rank_first))
+            results['result'].update(market_stats.summary())
 
-                rank_last = data_list[-1]['data']['rank']
-                logger.debug('rank_last: ' + str(rank_last))
+            results_json = results['result'].copy()
 
-                #rank_difference = rank_last - rank_first
-                rank_difference = rank_first - rank_last
-                logger.debug('rank_difference: ' + str(rank_difference))
+            del results_json['timestamp_delta']
+            del results_json['duration_string']
 
-                results['result'] = dict(price_first=price_first, price_last=price_last, price_difference=price_difference,
-                                         price_percent_difference=price_percent_difference,
-                                         marketcap_first=marketcap_first, marketcap_last=marketcap_last, marketcap_difference=marketcap_difference,
-                                         marketcap_percent_difference=marketcap_percent_difference,
-                                         rank_first=rank_first, rank_last=rank_last, rank_difference=rank_difference,
-                                         timestamp_first=timestamp_first, timestamp_last=timestamp_last, timestamp_delta=timestamp_delta,
-                                         duration_minutes=duration_minutes, duration_string=duration_string)
+            if self.mongo == True:
+                logger.info('Updating MongoDB document with final results.')
 
-                results_json = results['result'].copy()
+                self.mongo_writer.set_final(results_json)
 
-                del results_json['timestamp_delta']
-                del results_json['duration_string']
+            logger.info('Dumping final results to json file.')
 
-                if self.mongo == True:
-                    logger.info('Updating MongoDB document with final results.')
+            if not os.path.exists(self.market_directory + 'results/'):
+                os.mkdir(self.market_directory + 'results/')
 
-                    self.mongo_doc = self.db.find_one({'_id': self.doc_id})
+            results_file = self.market_directory + 'results/' + self.trade_product + '-' + self.quote_product + '_' + self.clock.now().strftime('%m%d%y-%H%M%S') + '.json'
 
-                    self.mongo_doc['results']['final'] = results_json
+            atomic_write(results_file, json.dumps(results_json, indent=4, sort_keys=True, ensure_ascii=False), fsync=self.fsync_policy)
 
-                    self.mongo_doc['status'][0] = 'Pass'
-                    self.mongo_doc['status'][1] = 'Complete'
+        except Exception as e:
+            logger.exception('Exception while preparing final results from tracker.')
+            logger.exception(e)
 
-                    update_result = self.db.update_one({'_id': self.doc_id}, {'$set': self.mongo_doc})
-                    logger.debug('update_result.matched_count: ' + str(update_result.matched_count))
-                    logger.debug('update_result.modified_count: ' + str(update_result.modified_count))
+            results['Exception'] = True
 
-                logger.info('Dumping final results to json file.')
+        finally:
+            return results
 
-                if not os.path.exists(self.market_directory + 'results/'):
-                    os.mkdir(self.market_directory + 'results/')
 
-                results_file = self.market_directory + 'results/' + self.trade_product + '-' + self.quote_product + '_' + datetime.datetime.now().strftime('%m%d%y-%H%M%S') + '.json'
+    def start_metrics_exporters(self):
+        if self.metrics_port != None:
+            start_metrics_server(self.metrics_port)
 
-                with open(results_file, 'w', encoding='utf-8') as file:
-                    json.dump(results_json, file, indent=4, sort_keys=True, ensure_ascii=False)
+        if self.metrics_file != None:
+            self.stats_writer = start_stats_file(self.metrics_file, interval=self.metrics_interval)
 
-            except Exception as e:
-                logger.exception('Exception while preparing final results from tracker.')
-                logger.exception(e)
 
-                results['Exception'] = True
+    def start_tracking(self, load_data=False, cmc_data=None):
+        self.start_metrics_exporters()
 
-            finally:
-                return results
+        market_data_archive = []
 
+        resume_state = None
 
-        self.db = MongoClient(self.url_atlas)[self.db_name][self.collection_name]
+        if self.checkpointer != None:
+            resume_state = self.load_checkpoint()
 
-        self.doc_id = self.db.insert_one(self.mongo_doc).inserted_id
-        logger.debug('self.doc_id: ' + str(self.doc_id))
+        if resume_state != None:
+            # Same data file, Mongo document and Slack thread as before the restart
+            logger.info('Resuming tracker for %s from checkpoint (run %s).', self.market_name, resume_state['run_id'])
 
-        market_data_archive = []
+            self.storage.resume()
 
-        if os.path.exists(self.cmc_data_file):
+        elif os.path.exists(self.cmc_data_file):
             if load_data == True:
                 try:
-                    with open(self.cmc_data_file, 'r', encoding='utf-8') as file:
-                        market_data_archive = json.load(file)
+                    market_data_archive = self.storage.load()
 
                 except:
                     logger.error('Failed to load json data from file.')
@@ -659,187 +747,459 @@ class TrackProduct:
             else:
                 logger.warning('Tracker file already present. An error may have occurred. Archiving tracker file and starting fresh.')
 
-                cmc_data_file_archived = self.cmc_data_file.rstrip('.json') + '_OLD.json'
+                cmc_data_file_archived = os.path.splitext(self.cmc_data_file)[0] + '_OLD' + self.storage.extension
 
                 shutil.move(self.cmc_data_file, cmc_data_file_archived)
 
-        if market_data_archive == []:
-            with open(self.cmc_data_file, 'w', encoding='utf-8') as file:
-                json.dump(market_data_archive, file, indent=4, sort_keys=True, ensure_ascii=False)
+        if resume_state == None and market_data_archive == []:
+            self.storage.initialize()
+
+        if self.mongo == True:
+            # Pooled client shared by every tracker in this process
+            database = get_mongo_client(self.url_atlas, **self.mongo_pool_options)[self.db_name]
+
+            self.db = database[self.collection_name]
+
+            if self.mongo_schema == 'timeseries':
+                samples_collection = ensure_samples_collection(database, self.samples_collection_name)
+
+                self.mongo_writer = MongoSampleWriter(self.db, samples_collection, self.market_name,
+                                                      batch_size=self.mongo_batch_size, batch_seconds=self.mongo_batch_seconds, clock=self.clock)
+
+            else:
+                self.mongo_writer = MongoRunWriter(self.db, incremental=self.mongo_incremental,
+                                                   batch_size=self.mongo_batch_size, batch_seconds=self.mongo_batch_seconds, clock=self.clock)
+
+            if resume_state != None:
+                self.doc_id = self.mongo_writer.resume(resume_state['doc_id'])
+
+            else:
+                # Resumed data goes in with the initial insert rather than as separate pushes
+                self.mongo_doc['results']['data'] = list(market_data_archive)
+
+                self.doc_id = self.mongo_writer.insert(self.mongo_doc)
 
         # Check to see if valid data available from Coinmarketcap
-        cmc_data = TrackProduct.cmc_client.ticker(currency=self.trade_product, convert=self.quote_product)
+        if cmc_data == None:
+            cmc_data = self.fetch_ticker(currency=self.trade_product, convert=self.quote_product)
 
         if cmc_data['data']['quotes'][self.quote_product]['price'] == None:
-            logger.warning('No valid Coinmarketcap data available for ' + self.trade_product + '. Exiting.')
+            logger.warning('No valid Coinmarketcap data available for %s.', self.trade_product)
 
             if self.mongo == True:
-                self.mongo_doc = self.db.find_one({'_id': self.doc_id})
+                self.mongo_writer.set_status('Fail', 'No valid data')
 
-                self.mongo_doc['status'][0] = 'Fail'
-                self.mongo_doc['status'][1] = 'No valid data'
+            return False
 
-                update_result = self.db.update_one({'_id': self.doc_id}, {'$set': self.mongo_doc})
-                logger.debug('update_result.matched_count: ' + str(update_result.matched_count))
-                logger.debug('update_result.modified_count: ' + str(update_result.modified_count))
+        if self.write_behind == True:
+            write_behind_sinks = [self.storage.append_many]
 
-            sys.exit()
+            if self.mongo == True:
+                write_behind_sinks.append(self.mongo_writer.push_many)
 
-        slack_message_last = 0
+            self.write_behind_writer = WriteBehindWriter(write_behind_sinks, name='write-behind-' + self.market_name,
+                                                         **self.write_behind_options)
 
-        update_count = 0
+        # Only the latest ticker is kept for change detection, the rest is summarized as it arrives
+        self.market_stats = RunningStats(self.quote_product)
 
-        new_data_ready = False
+        if self.keep_series == True:
+            self.market_series = TickerSeries(self.quote_product)
 
-        loop_start = time.time()
+        self.last_data = None
 
-        loop_count = 0
-        while (datetime.datetime.now() < self.track_end_time):
-            try:
-                ## HEARTBEAT
-                if self.heartbeat_monitor == True:
-                    self.hb.heartbeat(message='Quote Check: ' + self.market_name)
+        for record in market_data_archive:
+            self.record_ticker(record)
 
-                loop_count += 1
-                logger.debug('loop_count: ' + str(loop_count))
+        self.slack_message_last = 0
 
-                cmc_data = TrackProduct.cmc_client.ticker(currency=self.trade_product, convert=self.quote_product)
+        self.update_count = 0
 
-                if cmc_data['metadata']['error'] == None:
-                    if loop_count > 1 and cmc_data['data']['last_updated'] > market_data_archive[-1]['data']['last_updated']:
-                        update_count += 1
+        self.new_data_ready = False
 
-                        new_data_ready = True
+        self.loop_start = self.clock.time()
 
-                        market_data_archive.append(cmc_data)
+        self.loop_count = 0
 
-                        if self.mongo == True:
-                            logger.info('Updating MongoDB document with new data.')
+        if resume_state != None:
+            self.restore_checkpoint(resume_state)
 
-                            self.mongo_doc = self.db.find_one({'_id': self.doc_id})
+        else:
+            self.run_id = uuid.uuid4().hex
 
-                            self.mongo_doc['results']['data'] = market_data_archive
+        if self.adaptive_polling == True:
+            self.scheduler = AdaptivePoller(self.loop_time, clock=self.clock.time, sleep=self.clock.sleep, **self.poll_options)
 
-                            update_result = self.db.update_one({'_id': self.doc_id}, {'$set': self.mongo_doc})
-                            logger.debug('update_result.matched_count: ' + str(update_result.matched_count))
-                            logger.debug('update_result.modified_count: ' + str(update_result.modified_count))
+        else:
+            self.scheduler = TickScheduler(self.loop_time, key=self.market_name, jitter=self.schedule_jitter,
+                                           clock=self.clock.monotonic, sleep=self.clock.sleep)
 
-                        logger.debug('Dumping Coinmarketcap data to json file.')
+        return True
 
-                        with open(self.cmc_data_file, 'w', encoding='utf-8') as file:
-                            json.dump(market_data_archive, file, indent=4, sort_keys=True, ensure_ascii=False)
 
-                    elif loop_count == 1:
-                        update_count += 1
+    def load_checkpoint(self):
+        resume_state = self.checkpointer.load()
 
-                        market_data_archive.append(cmc_data)
+        if resume_state == None:
+            return None
 
-                        if self.mongo == True:
-                            logger.info('Updating MongoDB document with first data point.')
+        mongo_schema = self.mongo_schema if self.mongo == True else None
 
-                            self.mongo_doc = self.db.find_one({'_id': self.doc_id})
+        if (resume_state['market'] != self.market_name or resume_state['storage_format'] != self.storage_format or
+                resume_state['mongo_schema'] != mongo_schema or not os.path.exists(self.cmc_data_file)):
+            logger.warning('Checkpoint does not match tracker configuration. Starting a new run.')
 
-                            self.mongo_doc['results']['data'] = market_data_archive
+            return None
 
-                            update_result = self.db.update_one({'_id': self.doc_id}, {'$set': self.mongo_doc})
-                            logger.debug('update_result.matched_count: ' + str(update_result.matched_count))
-                            logger.debug('update_result.modified_count: ' + str(update_result.modified_count))
+        if datetime.datetime.fromtimestamp(resume_state['track_end_time']) <= self.clock.now():
+            logger.warning('Checkpointed run has already ended. Starting a new run.')
 
-                        slack_message = ''
-                        slack_message += '*_Started Coinmarketcap tracker for ' + cmc_data['data']['name'] + ' at ' + str(datetime.datetime.now()) + '._*\n'
-                        slack_message += '_Tracking product until ' + str(self.track_end_time) + '._\n\n'
+            return None
 
-                        #slack_message = format_slack_message(cmc_data, message_type='quote')
-                        slack_message += format_slack_message(cmc_data, message_type='quote')
-                        logger.debug('slack_message: ' + slack_message)
+        return resume_state
 
-                        logger.debug('Sending Slack alert.')
 
-                        alert_result = TrackProduct.send_slack_alert(self,
-                                                                     channel_id=self.slack_channel_id_tracker,
-                                                                     message=slack_message,
-                                                                     thread_id=self.slack_thread)#,
-                                                                     #broadcast=False)
-                        logger.debug('alert_result: ' + str(alert_result))
+    def restore_checkpoint(self, resume_state):
+        self.run_id = resume_state['run_id']
 
-                        if alert_result['Exception'] == False and self.dedicated_channel == True:
-                            self.slack_thread = alert_result['result']['message']['ts']
-                            logger.debug('self.slack_thread: ' + str(self.slack_thread))
+        self.track_end_time = datetime.datetime.fromtimestamp(resume_state['track_end_time'])
 
-                        slack_message_last = time.time()
+        self.market_stats = RunningStats.from_dict(resume_state['stats'])
 
-                    else:
-                        logger.debug('No new data available. Skipping append to data archive.')
+        self.last_data = resume_state['last_data']
 
-                else:
-                    logger.error('Coinmarketcap return metadata indicates an error occurred. Not adding to historical data.')
+        self.update_count = resume_state['update_count']
+
+        # Non-zero, so the next tick is treated as a continuation rather than a new run
+        self.loop_count = resume_state['loop_count']
 
-                    logger.error('Error: ' + str(cmc_data['metadata']['error']))
+        if self.dedicated_channel == True:
+            self.slack_thread = resume_state['slack_thread']
 
-                if (time.time() - slack_message_last) > self.slack_alert_interval:
-                    #if cmc_data['data']['last_updated'] > market_data_archive[-1]['data']['last_updated']:
-                    if new_data_ready == True:
-                        slack_message = format_slack_message(cmc_data, message_type='quote')
-                        logger.debug('slack_message: ' + slack_message)
+        if self.slack_client != None:
+            slack_message = '*_Resumed Coinmarketcap tracker for ' + self.market_name + ' at ' + str(self.clock.now()) + '._*\n'
+            slack_message += '_Tracking product until ' + str(self.track_end_time) + '._'
 
-                        time_remaining = (self.track_end_time - datetime.datetime.now()) / datetime.timedelta(minutes=1)
+            alert_result = TrackProduct.send_slack_alert(self,
+                                                         channel_id=self.slack_channel_id_tracker,
+                                                         message=slack_message,
+                                                         thread_id=self.slack_thread)
+            logger.debug('alert_result: %s', alert_result)
 
-                        slack_message += '\n\n' + '*_Tracking time remaining:_* ' + "{:.2f}".format(time_remaining) + ' min'
 
-                        logger.debug('Sending Slack alert.')
+    def current_slack_thread(self):
+        return self.slack_thread.ts if isinstance(self.slack_thread, SlackThread) else self.slack_thread
 
-                        alert_result = TrackProduct.send_slack_alert(self,
-                                                                     channel_id=self.slack_channel_id_tracker,
-                                                                     message=slack_message,
-                                                                     thread_id=self.slack_thread)#,
-                                                                     #broadcast=False)
 
-                        logger.debug('alert_result: ' + str(alert_result))
+    def checkpoint_state(self):
+        slack_thread = self.current_slack_thread()
 
-                        slack_message_last = time.time()
+        return {'run_id': self.run_id,
+                'market': self.market_name,
+                'storage_format': self.storage_format,
+                'mongo_schema': self.mongo_schema if self.mongo == True else None,
+                'doc_id': str(self.doc_id) if self.mongo == True else None,
+                'track_end_time': self.track_end_time.timestamp(),
+                'slack_thread': slack_thread,
+                'loop_count': self.loop_count,
+                'update_count': self.update_count,
+                'last_data': self.last_data,
+                'stats': self.market_stats.to_dict()}
 
-                        new_data_ready = False
 
-                    else:
-                        logger.debug('Slack alert ready, but no data update. Skipping.')
+    def save_checkpoint(self, force=False):
+        if self.checkpointer == None or (force == False and self.checkpointer.due() == False):
+            return
+
+        # The checkpoint must not get ahead of what has been persisted
+        if self.write_behind_writer != None:
+            # State as of this tick, saved by the writer thread once every record queued before it
+            # is written, so the loop never waits on storage
+            state = self.checkpoint_state()
+
+            def save_persisted():
+                if self.mongo_writer != None:
+                    self.mongo_writer.flush()
+
+                self.storage.sync()
+
+                self.write_checkpoint(state)
+
+            self.checkpointer.defer()
+
+            self.write_behind_writer.after_written(save_persisted)
+
+            return
+
+        if self.mongo_writer != None:
+            self.mongo_writer.flush()
+
+        self.storage.sync()
+
+        self.write_checkpoint(self.checkpoint_state())
+
+
+    def write_checkpoint(self, state):
+        try:
+            # Locked with checkpoint_slack_thread(), which may save from the Slack dispatcher thread
+            with self.checkpointer.lock:
+                # A state captured before the first Slack post resolved picks up the thread ts now
+                if state['slack_thread'] == None:
+                    state['slack_thread'] = self.current_slack_thread()
+
+                self.checkpointer.save(state)
+
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning('Failed to write checkpoint %s: %s', self.checkpointer.path, e)
+
+
+    def checkpoint_slack_thread(self, slack_thread):
+        # Runs on the Slack dispatcher thread once the run's first message is posted. A checkpoint
+        # saved before then has no thread ts, and a restart would open a second thread.
+        if self.checkpointer == None or slack_thread.ts == None:
+            return
+
+        try:
+            with self.checkpointer.lock:
+                saved_state = self.checkpointer.saved_state
+
+                if saved_state == None or saved_state['slack_thread'] != None:
+                    return
+
+                self.checkpointer.save(dict(saved_state, slack_thread=slack_thread.ts))
+
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning('Failed to write checkpoint %s: %s', self.checkpointer.path, e)
+
+
+    def process_ticker(self, cmc_data):
+        tick_start = time.perf_counter()
+
+        self.loop_count += 1
+        logger.debug('loop_count: %s', self.loop_count)
+
+        first_update = False
+
+        tick_outcome = 'updated'
+
+        if cmc_data['metadata']['error'] == None:
+            if self.adaptive_polling == True:
+                self.scheduler.observe(cmc_data['data']['last_updated'])
+
+            if self.loop_count > 1 and self.last_data != None and cmc_data['data']['last_updated'] > self.last_data['data']['last_updated']:
+                self.update_count += 1
+
+                self.new_data_ready = True
+
+                self.record_ticker(cmc_data)
+
+                self.persist_ticker(cmc_data)
+
+            elif self.loop_count == 1 or self.last_data == None:
+                self.update_count += 1
+
+                first_update = True
+
+                self.record_ticker(cmc_data)
+
+                self.persist_ticker(cmc_data)
+
+                slack_message = ''
+                slack_message += '*_Started Coinmarketcap tracker for ' + cmc_data['data']['name'] + ' at ' + str(self.clock.now()) + '._*\n'
+                slack_message += '_Tracking product until ' + str(self.track_end_time) + '._\n\n'
+
+                #slack_message = format_slack_message(cmc_data, message_type='quote')
+                slack_message += self.format_slack_message(cmc_data, message_type='quote')
+                logger.debug('slack_message: %s', slack_message)
+
+                logger.debug('Sending Slack alert.')
+
+                # With the dispatcher, replies queue behind this message and pick up its ts once it is posted
+                slack_thread_pending = None
+
+                on_first_post = None
+
+                if self.slack_dispatcher != None and self.dedicated_channel == True:
+                    slack_thread_pending = SlackThread()
+
+                    def on_first_post(result):
+                        slack_thread_pending.set_from_result(result)
+
+                        self.checkpoint_slack_thread(slack_thread_pending)
+
+                alert_result = TrackProduct.send_slack_alert(self,
+                                                             channel_id=self.slack_channel_id_tracker,
+                                                             message=slack_message,
+                                                             thread_id=self.slack_thread,
+                                                             on_result=on_first_post)#,
+                                                             #broadcast=False)
+                logger.debug('alert_result: %s', alert_result)
+
+                if slack_thread_pending != None:
+                    self.slack_thread = slack_thread_pending
+
+                elif alert_result['Exception'] == False and alert_result['result'] != None and self.dedicated_channel == True:
+                    self.slack_thread = alert_result['result']['message']['ts']
+                    logger.debug('self.slack_thread: %s', self.slack_thread)
+
+                self.slack_message_last = self.clock.time()
+
+            else:
+                logger.debug('No new data available. Skipping append to data archive.')
+
+                tick_outcome = 'unchanged'
+
+        else:
+            logger.error('Coinmarketcap return metadata indicates an error occurred. Not adding to historical data.')
+
+            logger.error('Error: %s', cmc_data['metadata']['error'])
 
-                time_elapsed = time.time() - loop_start
-                logger.debug('time_elapsed: ' + "{:.2f}".format(time_elapsed) + ' sec')
+            tick_outcome = 'error'
 
-                time_remaining = (self.track_end_time - datetime.datetime.now()) / datetime.timedelta(minutes=1)
-                logger.debug('time_remaining: ' + "{:.2f}".format(time_remaining) + ' min')
+        if (self.clock.time() - self.slack_message_last) > self.slack_alert_interval:
+            #if cmc_data['data']['last_updated'] > self.last_data['data']['last_updated']:
+            if self.new_data_ready == True:
+                slack_message = self.format_slack_message(cmc_data, message_type='quote')
+                logger.debug('slack_message: %s', slack_message)
 
-                logger.debug('update_count: ' + str(update_count))
+                time_remaining = (self.track_end_time - self.clock.now()) / datetime.timedelta(minutes=1)
 
-                logger.debug('Sleeping for ' + str(self.loop_time) + ' seconds.')
+                slack_message += '\n\n' + '*_Tracking time remaining:_* ' + "{:.2f}".format(time_remaining) + ' min'
 
-                time.sleep(self.loop_time)
+                logger.debug('Sending Slack alert.')
+
+                alert_result = TrackProduct.send_slack_alert(self,
+                                                             channel_id=self.slack_channel_id_tracker,
+                                                             message=slack_message,
+                                                             thread_id=self.slack_thread,
+                                                             coalesce=True)#,
+                                                             #broadcast=False)
+
+                logger.debug('alert_result: %s', alert_result)
+
+                self.slack_message_last = self.clock.time()
+
+                self.new_data_ready = False
+
+            else:
+                logger.debug('Slack alert ready, but no data update. Skipping.')
+
+        # Written right away once the run (and its Slack thread) exists, then every checkpoint_seconds
+        self.save_checkpoint(force=first_update)
+
+        metrics.increment('tracker_ticks_total', market=self.market_name, outcome=tick_outcome)
+
+        metrics.observe('tracker_tick_seconds', time.perf_counter() - tick_start, market=self.market_name)
+
+
+    def fetch_and_process(self):
+        if self.profiling_hook == None:
+            self.process_ticker(self.fetch_ticker(currency=self.trade_product, convert=self.quote_product))
+
+            return
+
+        self.profiling_hook.check()
+
+        with self.profiling_hook.capture():
+            self.process_ticker(self.fetch_ticker(currency=self.trade_product, convert=self.quote_product))
+
+
+    def profile_state(self):
+        # In-memory run data that grows with the run, for the profiling report
+        state = {'loop_count': self.loop_count, 'update_count': self.update_count}
+
+
+        if self.mongo_writer != None:
+            state['mongo_writer_data'] = len(self.mongo_writer.data)
+
+            state['mongo_writer_pending_data'] = len(self.mongo_writer.pending_data)
+
+        if self.market_series != None:
+            state['market_series'] = len(self.market_series)
+
+        if self.write_behind_writer != None:
+            state['write_behind_pending'] = self.write_behind_writer.queue.qsize()
+
+        return state
+
+
+    def record_schedule(self):
+        metrics.observe('tracker_loop_overrun_seconds', self.scheduler.lateness, market=self.market_name)
+
+        if self.scheduler.skipped > self.skipped_ticks:
+            metrics.increment('tracker_ticks_total', self.scheduler.skipped - self.skipped_ticks, market=self.market_name, outcome='skipped')
+
+            self.skipped_ticks = self.scheduler.skipped
+
+        # Only computed when someone is listening for debug output
+        if logger.isEnabledFor(logging.DEBUG):
+            time_elapsed = self.clock.time() - self.loop_start
+            logger.debug('time_elapsed: %.2f sec', time_elapsed)
+
+            time_remaining = (self.track_end_time - self.clock.now()) / datetime.timedelta(minutes=1)
+            logger.debug('time_remaining: %.2f min', time_remaining)
+
+            logger.debug('update_count: %s', self.update_count)
+
+
+    def record_ticker(self, cmc_data):
+        # Stats first: if the ticker is unusable, last_data and the series stay as they were and nothing is persisted
+        self.market_stats.update(cmc_data)
+
+        self.last_data = cmc_data
+
+        if self.market_series != None:
+            self.market_series.append(cmc_data)
+
+
+    def persist_ticker(self, cmc_data):
+        if self.write_behind_writer != None:
+            self.write_behind_writer.submit(cmc_data)
+
+            return
+
+        # Local archive first, so a Mongo failure can never cost the sample on disk
+        logger.debug('Writing Coinmarketcap data to json file.')
+
+        self.storage.append(cmc_data)
+
+        if self.mongo == True:
+            logger.info('Updating MongoDB document with new data.')
+
+            try:
+                self.mongo_writer.push_data(cmc_data)
 
             except Exception as e:
-                logger.exception('Exception while retrieving Coinmarketcap data.')
+                # The writer keeps unsent pushes buffered and sends them with the next flush
+                logger.exception('Exception while updating MongoDB document. Retrying with the next update.')
                 logger.exception(e)
 
-                #time.sleep(5)
+
+    def finish_tracking(self):
+        # Everything queued must be written before final results go to the same document/file
+        if self.write_behind_writer != None:
+            self.write_behind_writer.close()
+
+            self.write_behind_writer = None
 
         try:
-            if update_count > 1:
-                # Read json data from file or use current data dictionary?
-                tracker_results = prepare_results(data_list=market_data_archive)
+            if self.update_count > 1:
+                tracker_results = self.prepare_results()
 
-                logger.debug('tracker_results[\'Exception\']: ' + str(tracker_results['Exception']))
+                logger.debug('tracker_results[\'Exception\']: %s', tracker_results['Exception'])
 
-                logger.debug('tracker_results[\'result\']: ' + str(tracker_results['result']))
+                logger.debug('tracker_results[\'result\']: %s', tracker_results['result'])
 
                 if tracker_results['Exception'] == False:
                     tracker_message = '*_Final tracking results ready for ' + self.market_name + '._*\n\n'
-                    tracker_message = format_slack_message(input_data=tracker_results['result'], message_type='final')
+                    tracker_message = self.format_slack_message(input_data=tracker_results['result'], message_type='final')
 
                     message_result = TrackProduct.send_slack_alert(self,
                                                                    channel_id=self.slack_channel_id_tracker,
                                                                    message=tracker_message)#, thread_id=self.slack_thread,
                                                                    #broadcast=True)
 
-                    logger.debug('message_result: ' + str(message_result))
+                    logger.debug('message_result: %s', message_result)
 
                 else:
                     logger.error('Failed to send final Slack message to due exception while preparing results.')
@@ -852,100 +1212,114 @@ class TrackProduct:
             logger.exception(e)
 
         finally:
-            archive_file = self.archive_directory + self.cmc_data_file.split('/')[-1].split('.')[0] + '_' + datetime.datetime.now().strftime('%m%d%Y-%H%M%S') + '.json'
+            if self.mongo_writer != None:
+                self.mongo_writer.flush()
 
-            if os.path.exists(self.cmc_data_file):
-                shutil.move(self.cmc_data_file, archive_file)
+            self.storage.close()
 
-        if self.heartbeat_monitor == True:
-            logger.info('Disabling heartbeat.')
-
-            self.hb.disable_heartbeat()
-
-
-if __name__ == '__main__':
-    import multiprocessing
-    from multiprocessing import Process
+            archive_file = self.archive_directory + self.cmc_data_file.split('/')[-1].split('.')[0] + '_' + self.clock.now().strftime('%m%d%Y-%H%M%S')
 
-    test_config_path = '../../TeslaBot/config/config_tracker.ini'
+            if os.path.exists(self.cmc_data_file):
+                self.archive_data_file(archive_file)
 
-    test_slack_channel = 'testing'
+            if self.checkpointer != None:
+                self.checkpointer.clear()
 
-    #test_slack_channel_id = 'CAX1A4XU1'
+            # Tracker processes exit without running atexit handlers, so write the final numbers now
+            if self.stats_writer != None:
+                self.stats_writer.write()
 
-    cmc_tracker = TrackProduct(loop_time=30, slack_alerts=True, slack_alert_interval=1,
-                               config_path=test_config_path, heartbeat_monitor=False, mongo=True)
+        if self.heartbeat_monitor == True:
+            logger.info('Disabling heartbeat.')
 
-    test_market = 'XLM/BTC'
+            self.hb.disable_heartbeat()
 
-    # (self, market, tracking_duration, slack_channel=None, slack_thread=None)
 
-    parameter_result = cmc_tracker.set_parameters(market=test_market, tracking_duration=0.15, slack_channel=test_slack_channel)
-    logger.debug('parameter_result: ' + str(parameter_result))
+    def archive_data_file(self, archive_file):
+        if self.archive_codec != None:
+            try:
+                write_archive(self.storage.iter_records(), archive_file + archive_extension,
+                              codec=self.archive_codec if self.archive_codec != 'auto' else None,
+                              metadata={'market': self.market_name, 'run_id': self.run_id}, fsync=self.fsync_policy)
 
-    try:
-        #cmc_tracker.track_product(load_data=False)
+                os.remove(self.cmc_data_file)
 
-        arguments = tuple()
+                return
 
-        keyword_arguments = {'load_data': False}
+            except Exception as e:
+                logger.exception('Exception while compressing data file. Archiving uncompressed.')
+                logger.exception(e)
 
-        tracker_process = Process(target=cmc_tracker.track_product, args=arguments, kwargs=keyword_arguments)
+        shutil.move(self.cmc_data_file, archive_file + self.storage.extension)
 
-        logger.info('Starting tracker in separate process.')
 
-        tracker_process.start()
+    def track_product(self, load_data=False):
+        if self.start_tracking(load_data=load_data) == False:
+            logger.warning('Exiting tracker for %s.', self.market_name)
 
-        logger.info('Joining process.')
+            sys.exit()
 
-        tracker_process.join()
+        while (self.clock.now() < self.track_end_time):
+            # Sleeps until the next tick deadline, so loop work does not add to the period
+            self.scheduler.wait()
 
-    except Exception as e:
-        logger.exception('Unhandled exception in main loop.')
-        logger.exception(e)
+            self.record_schedule()
 
-    except KeyboardInterrupt:
-        logger.info('Exit signal received.')
+            try:
+                ## HEARTBEAT
+                if self.heartbeat_monitor == True:
+                    self.hb.heartbeat(message='Quote Check: ' + self.market_name)
 
-        #logger.info('Terminating tracker process.')
+                self.fetch_and_process()
 
-        #tracker_process.terminate()
+            except Exception as e:
+                logger.exception('Exception while retrieving Coinmarketcap data.')
+                logger.exception(e)
 
-        #logger.info('Joining terminated process to ensure clean exit.')
+                metrics.increment('tracker_ticks_total', market=self.market_name, outcome='exception')
 
-        #tracker_process.join()
+        self.finish_tracking()
 
-    finally:
-        """
-        logger.info('Terminating tracker process.')
+        # Tracker processes exit without running atexit handlers, so drain queued alerts here
+        if self.slack_dispatcher != None:
+            self.slack_dispatcher.flush(timeout=60)
 
-        tracker_process.terminate()
 
-        logger.info('Joining terminated process to ensure clean exit.')
+    async def track_product_async(self, load_data=False):
+        # Same loop as track_product(), but blocking work runs on the shared executor so many
+        # trackers can share one event loop (see aio.run_trackers)
+        self.clock.register()
 
-        tracker_process.join()
-        """
+        try:
+            if await run_blocking(self.start_tracking, load_data=load_data) == False:
+                logger.warning('Exiting tracker for %s.', self.market_name)
 
-        if cmc_tracker.heartbeat_monitor == True:
-            logger.info('Disabling heartbeat.')
+                return False
 
-            cmc_tracker.hb.disable_heartbeat()
+            while (self.clock.now() < self.track_end_time):
+                await self.clock.async_sleep(self.scheduler.next_delay())
 
-        logger.info('Gathering active child processes.')
+                self.record_schedule()
 
-        active_processes = multiprocessing.active_children()
+                try:
+                    ## HEARTBEAT
+                    if self.heartbeat_monitor == True:
+                        await run_blocking(self.hb.heartbeat, message='Quote Check: ' + self.market_name)
 
-        logger.info('Terminating all child processes.')
+                    # Fetch, Mongo and Slack I/O all happen on the executor thread, which is also where a profiling capture runs
+                    await run_blocking(self.fetch_and_process)
 
-        for proc in active_processes:
-            logger.debug('Child Process: ' + str(proc))
+                except Exception as e:
+                    logger.exception('Exception while retrieving Coinmarketcap data.')
+                    logger.exception(e)
 
-            proc.terminate()
+                    metrics.increment('tracker_ticks_total', market=self.market_name, outcome='exception')
 
-            logger.info('Joining terminated process to ensure clean exit.')
+            await run_blocking(self.finish_tracking)
 
-            proc.join()
+            return True
 
-        logger.info('Done.')
+        finally:
+            # Lets a simulated clock keep running for the trackers still going
+            self.clock.unregister()
 
-        #sys.exit()
@@ -0,0 +1,76 @@
+import logging
+import os
+import threading
+
+from pymongo import MongoClient
+
+logger = logging.getLogger(__name__)
+
+# One pooled MongoClient per (url, pool options) per process, shared by every TrackProduct and
+# reused across track_product() calls. Clients are created with connect=False so nothing is
+# opened until first use, and the registry is discarded in forked children (a MongoClient must
+# not be used across fork), so each tracker process lazily builds its own after the fork.
+_clients = {}
+
+_clients_pid = os.getpid()
+
+_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _clients, _clients_pid, _lock
+
+    _clients = {}
+
+    _clients_pid = os.getpid()
+
+    _lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def client_key(url, max_pool_size=None, min_pool_size=None, **client_options):
+    if max_pool_size != None:
+        client_options['maxPoolSize'] = max_pool_size
+
+    if min_pool_size != None:
+        client_options['minPoolSize'] = min_pool_size
+
+    return (url, tuple(sorted(client_options.items()))), client_options
+
+
+def get_mongo_client(url, max_pool_size=None, min_pool_size=None, **client_options):
+    # Fallback for interpreters without os.register_at_fork
+    if _clients_pid != os.getpid():
+        _reset_after_fork()
+
+    key, client_options = client_key(url, max_pool_size, min_pool_size, **client_options)
+
+    with _lock:
+        if key not in _clients:
+            logger.debug('Creating MongoDB client for process %s.', os.getpid())
+
+            _clients[key] = MongoClient(url, connect=False, **client_options)
+
+        return _clients[key]
+
+
+def register_mongo_client(url, client, max_pool_size=None, min_pool_size=None, **client_options):
+    # Makes get_mongo_client() return an existing client for these arguments (e.g. mongomock in benchmarks)
+    if _clients_pid != os.getpid():
+        _reset_after_fork()
+
+    key = client_key(url, max_pool_size, min_pool_size, **client_options)[0]
+
+    with _lock:
+        _clients[key] = client
+
+
+def close_mongo_clients():
+    with _lock:
+        for client in _clients.values():
+            client.close()
+
+        _clients.clear()
@@ -0,0 +1,169 @@
+import logging
+import random
+import time
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+logger = logging.getLogger(__name__)
+
+# In-process stand-ins for Coinmarketcap, Slack and MongoDB, used by the benchmarks so a
+# tracker can run without network access or credentials.
+
+
+class FakePymarketcap:
+    # Replacement for pymarketcap.Pymarketcap (assign to TrackProduct.cmc_client). Every symbol
+    # gets a synthetic random-walk ticker. Time moves through advance(), or follows clock (e.g. a
+    # clock.SimulatedClock shared with the trackers) if one is given. A symbol's last_updated
+    # changes once update_interval seconds have passed since its last update, like
+    # Coinmarketcap's periodic refresh.
+
+
+    def __init__(self, update_interval=300, start_time=None, seed=0, latency=0.0, clock=None):
+        self.update_interval = update_interval
+
+        self.clock = clock
+
+        if start_time == None:
+            start_time = clock.time() if clock != None else time.time()
+
+        self.now = int(start_time)
+
+        self.random = random.Random(seed)
+
+        self.latency = latency    # Seconds each request blocks for, to mimic network time
+
+        self.markets = {}    # symbol -> ticker state
+
+        self.request_count = 0
+
+
+    def advance(self, seconds):
+        self.advance_to(self.now + seconds)
+
+
+    def advance_to(self, timestamp):
+        if int(timestamp) <= self.now:
+            return
+
+        self.now = int(timestamp)
+
+        for symbol in self.markets:
+            self.update_market(symbol)
+
+
+    def market(self, symbol):
+        if symbol not in self.markets:
+            price = self.random.uniform(0.01, 100)
+
+            self.markets[symbol] = {'id': len(self.markets) + 1, 'rank': len(self.markets) + 1, 'price': price,
+                                    'volume_24h': price * self.random.uniform(1e5, 1e7), 'supply': self.random.uniform(1e6, 1e9),
+                                    'price_open': price, 'last_updated': self.now}
+
+        return self.markets[symbol]
+
+
+    def update_market(self, symbol):
+        state = self.markets[symbol]
+
+        if self.now - state['last_updated'] < self.update_interval:
+            return
+
+        state['price'] *= 1 + self.random.gauss(0, 0.005)
+
+        state['volume_24h'] *= 1 + self.random.gauss(0, 0.01)
+
+        state['last_updated'] = self.now - (self.now - state['last_updated']) % self.update_interval
+
+
+    def quote(self, state, convert):
+        # Quote products other than USD are priced against a fixed synthetic rate
+        rate = 1.0 if convert == 'USD' else 1 / 6500.0
+
+        return {'price': state['price'] * rate,
+                'volume_24h': state['volume_24h'] * rate,
+                'market_cap': state['price'] * state['supply'] * rate,
+                'percent_change_1h': self.random.uniform(-1, 1),
+                'percent_change_24h': (state['price'] / state['price_open'] - 1) * 100,
+                'percent_change_7d': self.random.uniform(-10, 10)}
+
+
+    def ticker_data(self, symbol, convert):
+        state = self.market(symbol)
+
+        quotes = {'USD': self.quote(state, 'USD')}
+
+        if convert != 'USD':
+            quotes[convert] = self.quote(state, convert)
+
+        return {'id': state['id'], 'name': symbol, 'symbol': symbol, 'website_slug': symbol.lower(), 'rank': state['rank'],
+                'circulating_supply': state['supply'], 'total_supply': state['supply'], 'max_supply': None,
+                'quotes': quotes, 'last_updated': state['last_updated']}
+
+
+    def ticker(self, currency=None, limit=100, start=1, convert='USD'):
+        self.request_count += 1
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        if self.clock != None:
+            self.advance_to(self.clock.time())
+
+        metadata = {'timestamp': self.now, 'error': None}
+
+        if currency != None:
+            return {'data': self.ticker_data(currency.upper(), convert), 'metadata': metadata}
+
+        # Listing: only the symbols seen so far, in rank order
+        listed = sorted(self.markets, key=lambda symbol: self.markets[symbol]['rank'])[start - 1:start - 1 + limit]
+
+        return {'data': {str(self.markets[symbol]['id']): self.ticker_data(symbol, convert) for symbol in listed}, 'metadata': metadata}
+
+
+class FakeSlackClient:
+    # Replacement for slackclient.SlackClient that answers the calls the tracker makes and counts them
+
+
+    def __init__(self, channels=None, latency=0.0):
+        self.channels = {name: 'C' + str(100000 + number) for number, name in enumerate(channels if channels != None else [])}
+
+        self.latency = latency
+
+        self.calls = {}    # method -> count
+
+        self.bytes_posted = 0
+
+        self.message_count = 0
+
+
+    def api_call(self, method, **kwargs):
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        if method == 'chat.postMessage':
+            self.message_count += 1
+
+            self.bytes_posted += len(kwargs.get('text', '').encode('utf-8'))
+
+            ts = '{:.6f}'.format(1500000000 + self.message_count / 1000000)
+
+            return {'ok': True, 'channel': kwargs.get('channel'), 'ts': ts,
+                    'message': {'ts': ts, 'text': kwargs.get('text'), 'thread_ts': kwargs.get('thread_ts')}}
+
+        if method == 'conversations.list':
+            return {'ok': True, 'channels': [{'name': name, 'id': channel_id} for name, channel_id in self.channels.items()],
+                    'response_metadata': {'next_cursor': ''}}
+
+        return {'ok': False, 'error': 'unknown_method'}
+
+
+def fake_mongo_client():
+    if mongomock == None:
+        raise ImportError('mongomock is required for an in-process MongoDB.')
+
+    return mongomock.MongoClient()
@@ -0,0 +1,79 @@
+import datetime
+import functools
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def quote_title(quote):
+    # 'percent_change_24h' -> 'Percent Change (24h)'
+    words = []
+
+    for word in quote.split('_'):
+        if word[0].isnumeric():
+            words.append('(' + word + ')')
+
+        else:
+            words.append(word.capitalize())
+
+    return ' '.join(words)
+
+
+def value_formatter(title, quote_product):
+    # Returns a function rendering one quote value for the given title, chosen once per template
+    if 'Volume' in title or title == 'Market Cap':
+        if quote_product == 'USD':
+            return '${:.2f}'.format
+
+        return ('{:.2f} ' + quote_product).format
+
+    if title == 'Price':
+        if quote_product == 'USD':
+            return lambda value: '${:.4f}'.format(value) if value < 1 else '${:.2f}'.format(value)
+
+        return ('{:.8f} ' + quote_product).format
+
+    if 'Percent' in title:
+        return '{:.2f}%'.format
+
+    logger.warning('Unknown quote message type: %s', title)
+
+    return lambda value: ''
+
+
+class QuoteFormatter:
+    # Slack quote block template for one quote product and one ordered set of quote keys.
+    # Titles and value formats are resolved once, so render() is a single pass and one join.
+
+
+    def __init__(self, quote_product, keys):
+        self.quote_product = quote_product
+
+        self.keys = keys
+
+        self.lines = [(key, '*' + quote_title(key) + ':* ', value_formatter(quote_title(key), quote_product)) for key in keys]
+
+
+    def render(self, quotes):
+        return '\n'.join([prefix + (formatter(quotes[key]) if quotes[key] != None else 'N/A') for key, prefix, formatter in self.lines])
+
+
+@functools.lru_cache(maxsize=256)
+def get_quote_formatter(quote_product, keys):
+    return QuoteFormatter(quote_product, keys)
+
+
+def render_quote_message(market_name, quote_product, cmc_data):
+    # Header plus quote block, as sent for each tracker update
+    dt_header = datetime.datetime.fromtimestamp(cmc_data['metadata']['timestamp']).strftime('%m-%d-%y %H:%M:%S')
+
+    quotes = cmc_data['data']['quotes'][quote_product]
+
+    formatter = get_quote_formatter(quote_product, tuple(quotes))
+
+    return '*_' + dt_header + ' - ' + market_name + '_*\n' + formatter.render(quotes)
+
+
+def render_quote_batch(items):
+    # items: iterable of (market_name, quote_product, cmc_data); one message block per market
+    return '\n\n'.join([render_quote_message(market_name, quote_product, cmc_data) for market_name, quote_product, cmc_data in items])
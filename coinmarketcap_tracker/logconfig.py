@@ -0,0 +1,92 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+default_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Listeners started by configure_logging() and not yet stopped -> (queue handler, loggers, output handler)
+_running_listeners = {}
+
+_listeners_lock = threading.Lock()
+
+
+def configure_logging(level=logging.INFO, log_queue=False, handler=None, log_format=default_format, logger_names=None):
+    # Configures the package logger. The tracker modules never set their own level, so this (or the
+    # application's own logging setup) decides how much is emitted. logger_names adds loggers outside
+    # the package that should get the same level and handler, e.g. '__main__' for a launcher script.
+    #
+    # With log_queue=True, records are handed to a QueueHandler and written by a QueueListener
+    # thread, so a slow terminal or log file never stalls the polling loop. Returns the listener
+    # (already started and stopped at exit) or None; stop it early with stop_listener().
+    loggers = [logging.getLogger(__package__)] + [logging.getLogger(name) for name in (logger_names or [])]
+
+    if handler == None:
+        handler = logging.StreamHandler()
+
+        handler.setFormatter(logging.Formatter(log_format))
+
+    listener = None
+
+    output_handler = handler
+
+    if log_queue == True:
+        record_queue = queue.Queue(-1)
+
+        listener = logging.handlers.QueueListener(record_queue, output_handler, respect_handler_level=True)
+
+        handler = logging.handlers.QueueHandler(record_queue)
+
+    for configured_logger in loggers:
+        configured_logger.setLevel(level)
+
+        for existing_handler in list(configured_logger.handlers):
+            configured_logger.removeHandler(existing_handler)
+
+        configured_logger.addHandler(handler)
+
+    if listener == None:
+        return None
+
+    listener.start()
+
+    with _listeners_lock:
+        _running_listeners[listener] = (handler, loggers, output_handler)
+
+    atexit.register(stop_listener, listener)
+
+    return listener
+
+
+def stop_listener(listener):
+    # Drains queued records. Safe to call more than once (QueueListener.stop() is not).
+    with _listeners_lock:
+        if listener not in _running_listeners:
+            return
+
+        del _running_listeners[listener]
+
+    listener.stop()
+
+
+def _reset_after_fork():
+    global _running_listeners, _listeners_lock
+
+    # The listener thread stays in the parent, so a forked tracker would queue records nobody reads.
+    # The child writes directly instead (it usually exits without atexit, which would drain a queue).
+    for queue_handler, loggers, output_handler in _running_listeners.values():
+        for configured_logger in loggers:
+            if queue_handler in configured_logger.handlers:
+                configured_logger.removeHandler(queue_handler)
+
+                configured_logger.addHandler(output_handler)
+
+    _running_listeners = {}
+
+    _listeners_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,344 @@
+import bisect
+import http.server
+import json
+import logging
+import os
+import socketserver
+import threading
+import time
+
+from .atomicfile import atomic_write
+
+logger = logging.getLogger(__name__)
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'bucket_counts', 'count', 'sum', 'min', 'max')
+
+
+    def __init__(self, buckets=default_buckets):
+        self.buckets = buckets
+
+        self.bucket_counts = [0] * (len(buckets) + 1)    # Last slot is +Inf
+
+        self.count = 0
+
+        self.sum = 0.0
+
+        self.min = None
+
+        self.max = None
+
+
+    def observe(self, value):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+
+        self.count += 1
+
+        self.sum += value
+
+        self.min = value if self.min == None else min(self.min, value)
+
+        self.max = value if self.max == None else max(self.max, value)
+
+
+    def cumulative_counts(self):
+        total = 0
+
+        counts = []
+
+        for bucket_count in self.bucket_counts:
+            total += bucket_count
+
+            counts.append(total)
+
+        return counts
+
+
+    def to_dict(self):
+        return {'count': self.count, 'sum': self.sum, 'min': self.min, 'max': self.max,
+                'mean': self.sum / self.count if self.count > 0 else None,
+                'buckets': dict(zip([str(bucket) for bucket in self.buckets] + ['+Inf'], self.cumulative_counts()))}
+
+
+class Timer:
+    # with registry.timer('name', label=value): ... observes the block's duration in seconds
+    __slots__ = ('registry', 'name', 'labels', 'start')
+
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+
+        self.name = name
+
+        self.labels = labels
+
+        self.start = None
+
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.registry.observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+class MetricsRegistry:
+    # Process-wide counters and latency histograms for the tracker loop, keyed by name and labels.
+    # Exported in Prometheus text format (MetricsServer) or as a json stats file (StatsFileWriter).
+
+
+    def __init__(self):
+        self.counters = {}    # (name, labels) -> value
+
+        self.histograms = {}    # (name, labels) -> Histogram
+
+        self.descriptions = {}
+
+        self.lock = threading.Lock()
+
+
+    def describe(self, name, description):
+        self.descriptions[name] = description
+
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+
+        with self.lock:
+            histogram = self.histograms.get(key)
+
+            if histogram == None:
+                histogram = self.histograms[key] = Histogram()
+
+            histogram.observe(value)
+
+
+    def timer(self, name, **labels):
+        return Timer(self, name, labels)
+
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+
+            self.histograms.clear()
+
+
+    def to_dict(self):
+        with self.lock:
+            return {'timestamp': time.time(), 'pid': os.getpid(),
+                    'counters': [{'name': name, 'labels': dict(labels), 'value': value} for (name, labels), value in sorted(self.counters.items())],
+                    'histograms': [dict(histogram.to_dict(), name=name, labels=dict(labels)) for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0])]}
+
+
+    def render_prometheus(self):
+        lines = []
+
+        with self.lock:
+            counter_names = sorted(set(name for name, labels in self.counters))
+
+            for name in counter_names:
+                self.render_header(lines, name, 'counter')
+
+                for (counter_name, labels), value in sorted(self.counters.items()):
+                    if counter_name == name:
+                        lines.append(name + format_labels(labels) + ' ' + str(value))
+
+            histogram_names = sorted(set(name for name, labels in self.histograms))
+
+            for name in histogram_names:
+                self.render_header(lines, name, 'histogram')
+
+                for (histogram_name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                    if histogram_name != name:
+                        continue
+
+                    for bucket, count in zip([repr(float(bucket)) for bucket in histogram.buckets] + ['+Inf'], histogram.cumulative_counts()):
+                        lines.append(name + '_bucket' + format_labels(labels + (('le', bucket),)) + ' ' + str(count))
+
+                    lines.append(name + '_sum' + format_labels(labels) + ' ' + repr(histogram.sum))
+                    lines.append(name + '_count' + format_labels(labels) + ' ' + str(histogram.count))
+
+        return '\n'.join(lines) + '\n'
+
+
+    def render_header(self, lines, name, metric_type):
+        if name in self.descriptions:
+            lines.append('# HELP ' + name + ' ' + self.descriptions[name])
+
+        lines.append('# TYPE ' + name + ' ' + metric_type)
+
+
+def format_labels(labels):
+    if len(labels) == 0:
+        return ''
+
+    return '{' + ','.join(key + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"' for key, value in labels) + '}'
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    registry = None
+
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+
+            return
+
+        body = self.registry.render_prometheus().encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        logger.debug('Metrics request: ' + format, *args)
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class MetricsServer:
+    # Serves the registry at http://host:port/metrics from a daemon thread
+
+
+    def __init__(self, registry, port, host='127.0.0.1'):
+        handler = type('BoundMetricsHandler', (MetricsHandler,), {'registry': registry})
+
+        self.server = ThreadingHTTPServer((host, port), handler)
+
+        self.thread = threading.Thread(target=self.server.serve_forever, name='metrics-server', daemon=True)
+
+        self.thread.start()
+
+        logger.info('Serving tracker metrics on http://%s:%s/metrics', host, self.server.server_address[1])
+
+
+    def close(self):
+        self.server.shutdown()
+
+        self.server.server_close()
+
+
+class StatsFileWriter:
+    # Rewrites path with the registry's json snapshot every interval seconds
+
+
+    def __init__(self, registry, path, interval=60):
+        self.registry = registry
+
+        self.path = path
+
+        self.interval = interval
+
+        self.stopped = threading.Event()
+
+        self.thread = threading.Thread(target=self.run, name='metrics-file', daemon=True)
+
+        self.thread.start()
+
+
+    def write(self):
+        try:
+            atomic_write(self.path, json.dumps(self.registry.to_dict(), indent=4, sort_keys=True), fsync='never')
+
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning('Failed to write metrics file %s: %s', self.path, e)
+
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+
+    def close(self):
+        self.stopped.set()
+
+        self.write()
+
+
+metrics = MetricsRegistry()
+
+metrics.describe('tracker_fetch_seconds', 'Coinmarketcap ticker request latency (cache misses only, excluding rate limit waits).')
+metrics.describe('tracker_governor_wait_seconds', 'Time the request governor held a request back, by reason: rate_limit or backoff.')
+metrics.describe('tracker_mongo_seconds', 'MongoDB round trip latency by operation.')
+metrics.describe('tracker_storage_write_seconds', 'Time to write tracker data to the local archive file.')
+metrics.describe('tracker_slack_post_seconds', 'Slack chat.postMessage latency.')
+metrics.describe('tracker_tick_seconds', 'Time to process one ticker (change detection, persistence, alerts).')
+metrics.describe('tracker_loop_overrun_seconds', 'How late each tick started relative to its schedule.')
+metrics.describe('tracker_ticks_total', 'Ticks by outcome: updated, unchanged, error, exception, skipped.')
+
+_servers = {}
+
+_stats_writers = {}
+
+_exporters_lock = threading.Lock()
+
+
+def start_metrics_server(port, host='127.0.0.1'):
+    # One server per (host, port) per process; later trackers reuse it. Each process has its own
+    # registry, so with one process per market only the first to bind a fixed port serves it and the
+    # rest log a warning and return None. Port 0 binds any free port per process (logged on start).
+    with _exporters_lock:
+        if (host, port) not in _servers:
+            try:
+                _servers[(host, port)] = MetricsServer(metrics, port, host)
+
+            except OSError as e:
+                logger.warning('Metrics server not started on %s:%s (%s). Use port 0 for one port per process, '
+                               'or a metrics file with {pid}.', host, port, e)
+
+                _servers[(host, port)] = None
+
+        return _servers[(host, port)]
+
+
+def start_stats_file(path, interval=60):
+    # '{pid}' in path is replaced, so each tracker process can keep its own file
+    path = path.replace('{pid}', str(os.getpid()))
+
+    with _exporters_lock:
+        if path not in _stats_writers:
+            _stats_writers[path] = StatsFileWriter(metrics, path, interval)
+
+        return _stats_writers[path]
+
+
+def _reset_after_fork():
+    global _servers, _stats_writers, _exporters_lock
+
+    # Exporter threads do not survive fork, and a child should only report its own work
+    metrics.counters = {}
+
+    metrics.histograms = {}
+
+    metrics.lock = threading.Lock()
+
+    _servers = {}
+
+    _stats_writers = {}
+
+    _exporters_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
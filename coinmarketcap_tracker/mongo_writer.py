@@ -0,0 +1,229 @@
+import datetime
+import logging
+
+from bson import ObjectId
+from pymongo import ASCENDING
+from pymongo.errors import CollectionInvalid, OperationFailure
+
+from .clock import system_clock
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class MongoRunWriter:
+    # Persists a tracking run document ({'results': {'data': [...], 'final': ...}, 'status': [...]})
+    #
+    # incremental=True pushes only new tickers and $sets only the fields that changed, optionally
+    # batching several ticks into one update. incremental=False keeps the original behaviour of
+    # re-reading the document and $setting the whole thing on every change.
+
+
+    def __init__(self, collection, incremental=True, batch_size=1, batch_seconds=0, clock=None):
+        self.collection = collection
+
+        self.clock = clock if clock != None else system_clock    # batch_seconds is measured on this clock
+
+        self.incremental = incremental
+
+        self.batch_size = batch_size    # Tickers buffered before a write (1 = write every tick)
+
+        self.batch_seconds = batch_seconds    # Max seconds a buffered ticker can wait (0 = no time limit)
+
+        self.doc_id = None
+
+        self.data = []    # Only used when incremental=False
+
+        self.pending_data = []
+
+        self.pending_set = {}
+
+        self.pending_since = None
+
+
+    def insert(self, document):
+        if self.incremental == False:
+            self.data = list(document['results']['data'])
+
+        self.doc_id = self.timed('insert_one', self.collection.insert_one, document).inserted_id
+        logger.debug('doc_id: %s', self.doc_id)
+
+        return self.doc_id
+
+
+    def resume(self, doc_id):
+        # Continues an existing run document (e.g. from a checkpoint) instead of inserting one
+        self.doc_id = ObjectId(doc_id) if isinstance(doc_id, str) else doc_id
+        logger.debug('doc_id: %s', self.doc_id)
+
+        if self.incremental == False:
+            self.data = self.timed('find_one', self.collection.find_one, {'_id': self.doc_id})['results']['data']
+
+        return self.doc_id
+
+
+    def push_data(self, record):
+        self.push_many([record])
+
+
+    def push_many(self, records):
+        if self.incremental == False:
+            self.data.extend(records)
+
+            mongo_doc = self.timed('find_one', self.collection.find_one, {'_id': self.doc_id})
+
+            mongo_doc['results']['data'] = self.data
+
+            self.log_result(self.timed('update_one', self.collection.update_one, {'_id': self.doc_id}, {'$set': mongo_doc}))
+
+            return
+
+        if self.pending_since == None:
+            self.pending_since = self.clock.time()
+
+        self.pending_data.extend(records)
+
+        if len(self.pending_data) >= self.batch_size or (self.batch_seconds > 0 and (self.clock.time() - self.pending_since) > self.batch_seconds):
+            self.flush()
+
+
+    def set_fields(self, fields):
+        if self.incremental == False:
+            mongo_doc = self.timed('find_one', self.collection.find_one, {'_id': self.doc_id})
+
+            for field in fields:
+                target = mongo_doc
+
+                path = field.split('.')
+
+                for key in path[:-1]:
+                    target = target[key]
+
+                target[path[-1]] = fields[field]
+
+            self.log_result(self.timed('update_one', self.collection.update_one, {'_id': self.doc_id}, {'$set': mongo_doc}))
+
+            return
+
+        self.pending_set.update(fields)
+
+        self.flush()
+
+
+    def set_status(self, state, detail):
+        self.set_fields({'status': [state, detail]})
+
+
+    def set_final(self, results):
+        self.set_fields({'results.final': results, 'status': ['Pass', 'Complete']})
+
+
+    def flush(self):
+        if self.incremental == False or (self.pending_data == [] and self.pending_set == {}):
+            return
+
+        # Pushes and targeted field updates touch different paths, so they share one round trip
+        update = {}
+
+        if self.pending_data != []:
+            update['$push'] = {'results.data': {'$each': self.pending_data}}
+
+        if self.pending_set != {}:
+            update['$set'] = self.pending_set
+
+        self.log_result(self.timed('update_one', self.collection.update_one, {'_id': self.doc_id}, update))
+
+        self.pending_data = []
+
+        self.pending_set = {}
+
+        self.pending_since = None
+
+
+    def timed(self, operation, func, *args, **kwargs):
+        with metrics.timer('tracker_mongo_seconds', operation=operation):
+            return func(*args, **kwargs)
+
+
+    def log_result(self, update_result):
+        logger.debug('update_result.matched_count: %s', update_result.matched_count)
+        logger.debug('update_result.modified_count: %s', update_result.modified_count)
+
+
+class MongoSampleWriter(MongoRunWriter):
+    # Alternative layout: one document per ticker in a separate (time-series) samples collection,
+    # tagged with the run document's _id and the market. The run document only holds metadata,
+    # status and results.final, so it no longer grows with the run or nears the 16 MB limit.
+
+
+    def __init__(self, collection, samples_collection, market, batch_size=1, batch_seconds=0, clock=None):
+        MongoRunWriter.__init__(self, collection, incremental=True, batch_size=batch_size, batch_seconds=batch_seconds, clock=clock)
+
+        self.samples_collection = samples_collection
+
+        self.market = market
+
+
+    def insert(self, document):
+        # Resumed tickers become samples rather than part of the run document
+        records = document['results'].pop('data', [])
+
+        document['samples_collection'] = self.samples_collection.name
+
+        self.doc_id = self.timed('insert_one', self.collection.insert_one, document).inserted_id
+        logger.debug('doc_id: %s', self.doc_id)
+
+        if records != []:
+            self.push_many(records)
+
+            self.flush()
+
+        return self.doc_id
+
+
+    def make_sample(self, record):
+        return {'timestamp': datetime.datetime.utcfromtimestamp(record['metadata']['timestamp']),
+                'meta': {'run_id': self.doc_id, 'market': self.market},
+                'ticker': record}
+
+
+    def flush(self):
+        if self.pending_data != []:
+            insert_result = self.timed('insert_many', self.samples_collection.insert_many, [self.make_sample(record) for record in self.pending_data], ordered=False)
+            logger.debug('Inserted %s sample(s).', len(insert_result.inserted_ids))
+
+            self.pending_data = []
+
+            self.pending_since = None
+
+        if self.pending_set != {}:
+            self.log_result(self.timed('update_one', self.collection.update_one, {'_id': self.doc_id}, {'$set': self.pending_set}))
+
+            self.pending_set = {}
+
+
+ensured_collections = set()
+
+
+def ensure_samples_collection(database, name, granularity='minutes'):
+    # Creates the samples collection as a MongoDB time-series collection (5.0+), falling back to
+    # a regular collection on older servers, and indexes it on (run_id, timestamp)
+    key = (database.name, name)
+
+    if key not in ensured_collections:
+        if name not in database.list_collection_names():
+            try:
+                database.create_collection(name, timeseries={'timeField': 'timestamp', 'metaField': 'meta', 'granularity': granularity})
+
+            except CollectionInvalid:
+                pass    # Created concurrently by another tracker
+
+            except (OperationFailure, NotImplementedError) as e:
+                # NotImplementedError: mongomock (benchmarks) has no time-series option
+                logger.warning('Time-series collections unsupported (%s). Using regular collection for samples.', e)
+
+        database[name].create_index([('meta.run_id', ASCENDING), ('timestamp', ASCENDING)])
+
+        ensured_collections.add(key)
+
+    return database[name]
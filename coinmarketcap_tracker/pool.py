@@ -0,0 +1,183 @@
+import logging
+
+from .clock import bind_to_clock, system_clock
+from .coinmarketcap_tracker import TrackProduct
+from .scheduler import TickScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class TrackerPool:
+    # Runs many TrackProduct instances in one process. Markets are grouped by quote product and
+    # each group is served from one paged bulk ticker listing per cycle instead of one request
+    # per market. Markets not found in the listing fall back to an individual ticker request.
+    # clock drives the cycle schedule and should be the one the trackers were built with (e.g. a
+    # shared clock.SimulatedClock); each tracker's end time is checked against its own clock.
+
+
+    def __init__(self, loop_time=300, listing_limit=100, max_listing_pages=5, cmc_client=None, request_governor=None, clock=None):
+        self.loop_time = loop_time
+
+        self.clock = clock if clock != None else system_clock
+
+        self.listing_limit = listing_limit    # Coinmarketcap caps a listing page at 100 entries
+
+        self.max_listing_pages = max_listing_pages
+
+        self.cmc_client = cmc_client if cmc_client != None else TrackProduct.cmc_client
+
+        self.request_governor = bind_to_clock(request_governor if request_governor != None else TrackProduct.request_governor, self.clock)
+
+        self.trackers = []
+
+        self.pending = []    # (tracker, load_data) waiting for their first data point
+
+
+    def add_tracker(self, tracker, load_data=False):
+        # Tracker must already be configured with set_parameters()
+        self.pending.append((tracker, load_data))
+
+
+    def quote_groups(self):
+        groups = {}
+
+        for tracker in self.trackers + [pending[0] for pending in self.pending]:
+            groups.setdefault(tracker.quote_product, set()).add(tracker.trade_product)
+
+        return groups
+
+
+    def request(self, endpoint, **kwargs):
+        if self.request_governor != None:
+            return self.request_governor.call(endpoint, self.cmc_client.ticker, **kwargs)
+
+        return self.cmc_client.ticker(**kwargs)
+
+
+    def fetch_listing(self, quote_product, symbols):
+        found = {}
+
+        start = 1
+
+        for page in range(self.max_listing_pages):
+            listing = self.request('listing', start=start, limit=self.listing_limit, convert=quote_product)
+
+            if listing['metadata'].get('error') != None:
+                logger.error('Coinmarketcap listing returned an error for %s: %s', quote_product, listing['metadata']['error'])
+
+                break
+
+            if isinstance(listing['data'], dict):
+                entries = list(listing['data'].values())
+
+            else:
+                entries = listing['data']
+
+            for entry in entries:
+                symbol = entry['symbol']
+
+                if symbol not in symbols:
+                    continue
+
+                # Symbols are not unique on Coinmarketcap, keep the highest ranked match
+                if symbol in found and found[symbol]['data']['rank'] <= entry['rank']:
+                    continue
+
+                found[symbol] = {'data': entry,
+                                 'metadata': {'timestamp': listing['metadata']['timestamp'], 'error': None}}
+
+            if len(found) == len(symbols) or len(entries) < self.listing_limit:
+                break
+
+            start += self.listing_limit
+
+        for symbol in symbols - set(found):
+            logger.debug('%s not in %s listing. Requesting ticker individually.', symbol, quote_product)
+
+            try:
+                found[symbol] = self.request('ticker', currency=symbol, convert=quote_product)
+
+            except Exception as e:
+                logger.exception('Exception while retrieving Coinmarketcap data for %s.', symbol)
+                logger.exception(e)
+
+        return found
+
+
+    def fetch_all(self):
+        tickers = {}
+
+        for quote_product, symbols in self.quote_groups().items():
+            try:
+                tickers[quote_product] = self.fetch_listing(quote_product, symbols)
+
+            except Exception as e:
+                logger.exception('Exception while retrieving Coinmarketcap listing for %s.', quote_product)
+                logger.exception(e)
+
+                tickers[quote_product] = {}
+
+        return tickers
+
+
+    def run_cycle(self):
+        tickers = self.fetch_all()
+
+        for tracker, load_data in list(self.pending):
+            cmc_data = tickers[tracker.quote_product].get(tracker.trade_product)
+
+            if cmc_data == None:
+                if tracker.clock.now() >= tracker.track_end_time:
+                    logger.warning('Tracking period ended before any data was available for %s.', tracker.market_name)
+
+                    self.pending.remove((tracker, load_data))
+
+                else:
+                    logger.warning('No Coinmarketcap data for %s. Retrying next cycle.', tracker.market_name)
+
+                continue
+
+            self.pending.remove((tracker, load_data))
+
+            try:
+                if tracker.start_tracking(load_data=load_data, cmc_data=cmc_data) == True:
+                    self.trackers.append(tracker)
+
+                else:
+                    logger.warning('Dropping tracker for %s.', tracker.market_name)
+
+            except Exception as e:
+                logger.exception('Exception while starting tracker for %s.', tracker.market_name)
+                logger.exception(e)
+
+        for tracker in list(self.trackers):
+            if tracker.clock.now() >= tracker.track_end_time:
+                self.trackers.remove(tracker)
+
+                tracker.finish_tracking()
+
+                continue
+
+            cmc_data = tickers[tracker.quote_product].get(tracker.trade_product)
+
+            if cmc_data == None:
+                continue
+
+            try:
+                if tracker.heartbeat_monitor == True:
+                    tracker.hb.heartbeat(message='Quote Check: ' + tracker.market_name)
+
+                tracker.process_ticker(cmc_data)
+
+            except Exception as e:
+                logger.exception('Exception while processing Coinmarketcap data for %s.', tracker.market_name)
+                logger.exception(e)
+
+
+    def run(self):
+        scheduler = TickScheduler(self.loop_time, clock=self.clock.monotonic, sleep=self.clock.sleep)
+
+        while len(self.trackers) > 0 or len(self.pending) > 0:
+            scheduler.wait()
+
+            self.run_cycle()
@@ -0,0 +1,295 @@
+import cProfile
+import datetime
+import io
+import logging
+import marshal
+import os
+import pstats
+import signal
+import threading
+import time
+import tracemalloc
+import weakref
+
+from .atomicfile import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Every hook in the process, so one signal starts a capture in all trackers
+_hooks = weakref.WeakSet()
+
+_signal_installed = False
+
+# tracemalloc is process-wide: hooks share it and the last capture to finish stops it
+_tracemalloc_users = 0
+
+_tracemalloc_started = False
+
+_tracemalloc_lock = threading.Lock()
+
+
+def acquire_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_started
+
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+
+            _tracemalloc_started = True
+
+        _tracemalloc_users += 1
+
+
+def release_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_started
+
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+
+        # Left running if something outside the hooks started it
+        if _tracemalloc_users == 0 and _tracemalloc_started == True:
+            tracemalloc.stop()
+
+            _tracemalloc_started = False
+
+
+class ProfilingHook:
+    # Opt-in profiling of a running tracker. A capture is requested by sending the process
+    # SIGUSR2 (where available), creating trigger_file, or calling request(). For the next
+    # window_seconds, every tick run inside capture() is profiled with cProfile and memory
+    # allocations are traced. Then these files are written to output_directory:
+    #   profile_<time>.prof            cProfile stats (pstats / snakeviz compatible)
+    #   profile_<time>.txt             top_n functions by cumulative time
+    #   tracemalloc_<time>.txt         top_n allocation sites, growth over the window and state()
+    # state is an optional callable returning {name: value} (e.g. in-memory record counts), recorded
+    # at the start and end of the window.
+
+
+    def __init__(self, output_directory, window_seconds=60, top_n=25, trigger_file=None, use_signal=True, state=None):
+        self.output_directory = output_directory
+
+        self.window_seconds = window_seconds
+
+        self.top_n = top_n
+
+        self.trigger_file = trigger_file
+
+        self.requested = False
+
+        self.profile = None
+
+        self.window_end = None
+
+        self.snapshot_start = None
+
+        self.state = state
+
+        self.state_start = None
+
+        self.lock = threading.Lock()
+
+        _hooks.add(self)
+
+        if use_signal == True:
+            install_signal_handler()
+
+
+    def request(self):
+        self.requested = True
+
+
+    def check(self):
+        # Called once per tick: starts a requested capture, or finishes one whose window has passed
+        if self.trigger_file != None and os.path.exists(self.trigger_file):
+            try:
+                os.remove(self.trigger_file)
+
+            except OSError:
+                pass
+
+            self.requested = True
+
+        with self.lock:
+            if self.profile == None and self.requested == True:
+                self.start()
+
+            elif self.profile != None and time.monotonic() >= self.window_end:
+                self.finish()
+
+
+    def start(self):
+        self.requested = False
+
+        logger.warning('Starting %s second profiling capture. Output: %s', self.window_seconds, self.output_directory)
+
+        acquire_tracemalloc()
+
+        self.snapshot_start = tracemalloc.take_snapshot()
+
+        self.state_start = self.read_state()
+
+        self.profile = cProfile.Profile()
+
+        self.window_end = time.monotonic() + self.window_seconds
+
+
+    def capture(self):
+        return ProfileCapture(self)
+
+
+    def finish(self):
+        profile = self.profile
+
+        self.profile = None
+
+        try:
+            try:
+                snapshot = tracemalloc.take_snapshot()
+
+            finally:
+                release_tracemalloc()
+
+            if not os.path.exists(self.output_directory):
+                os.makedirs(self.output_directory, exist_ok=True)
+
+            suffix = datetime.datetime.now().strftime('%m%d%y-%H%M%S')
+
+            # Captures finishing within the same second get numbered instead of overwriting each other
+            base_suffix = suffix
+
+            capture_number = 1
+
+            while os.path.exists(os.path.join(self.output_directory, 'profile_' + suffix + '.prof')):
+                capture_number += 1
+
+                suffix = base_suffix + '_' + str(capture_number)
+
+            self.write_profile(profile, os.path.join(self.output_directory, 'profile_' + suffix))
+
+            self.write_snapshot(snapshot, os.path.join(self.output_directory, 'tracemalloc_' + suffix + '.txt'))
+
+            logger.warning('Profiling capture written to %s (profile_%s.*).', self.output_directory, suffix)
+
+        except Exception as e:
+            logger.exception('Exception while writing profiling capture.')
+            logger.exception(e)
+
+        self.snapshot_start = None
+
+        self.state_start = None
+
+
+    def read_state(self):
+        if self.state == None:
+            return None
+
+        try:
+            return self.state()
+
+        except Exception as e:
+            logger.warning('Failed to read tracker state for profiling capture: %s', e)
+
+            return None
+
+
+    def write_profile(self, profile, path_base):
+        profile.create_stats()
+
+        # Same format as pstats.Stats.dump_stats()
+        atomic_write(path_base + '.prof', marshal.dumps(profile.stats), fsync='never')
+
+        summary = io.StringIO()
+
+        if profile.stats:
+            pstats.Stats(profile, stream=summary).sort_stats('cumulative').print_stats(self.top_n)
+
+        else:
+            summary.write('No ticks ran during the capture window.\n')
+
+        atomic_write(path_base + '.txt', summary.getvalue(), fsync='never')
+
+
+    def write_snapshot(self, snapshot, path):
+        # Skip tracemalloc's own bookkeeping
+        snapshot_filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+
+        snapshot = snapshot.filter_traces(snapshot_filters)
+
+        lines = ['Top ' + str(self.top_n) + ' allocation sites:']
+
+        for stat in snapshot.statistics('lineno')[:self.top_n]:
+            lines.append(str(stat))
+
+        if self.snapshot_start != None:
+            lines.append('')
+            lines.append('Top ' + str(self.top_n) + ' allocation changes over the capture window:')
+
+            for stat in snapshot.compare_to(self.snapshot_start.filter_traces(snapshot_filters), 'lineno')[:self.top_n]:
+                lines.append(str(stat))
+
+        lines.append('')
+        lines.append('Traced memory: ' + str(sum(stat.size for stat in snapshot.statistics('filename'))) + ' bytes')
+
+        state_end = self.read_state()
+
+        if state_end != None:
+            lines.append('')
+            lines.append('Tracker state (start -> end of window):')
+
+            for name in sorted(state_end):
+                start_value = self.state_start.get(name) if self.state_start != None else None
+
+                lines.append('  ' + name + ': ' + str(start_value) + ' -> ' + str(state_end[name]))
+
+        atomic_write(path, '\n'.join(lines) + '\n', fsync='never')
+
+
+class ProfileCapture:
+    # Enables the hook's profiler around a tick, in whichever thread runs it
+    __slots__ = ('hook', 'profile')
+
+
+    def __init__(self, hook):
+        self.hook = hook
+
+        self.profile = None
+
+
+    def __enter__(self):
+        self.profile = self.hook.profile
+
+        if self.profile != None:
+            try:
+                self.profile.enable()
+
+            except ValueError:
+                # Another tracker thread is already inside this profiler
+                self.profile = None
+
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.profile != None:
+            self.profile.disable()
+
+
+def handle_signal(signal_number, frame):
+    for hook in list(_hooks):
+        hook.request()
+
+
+def install_signal_handler():
+    global _signal_installed
+
+    if _signal_installed == True or not hasattr(signal, 'SIGUSR2'):
+        return
+
+    try:
+        signal.signal(signal.SIGUSR2, handle_signal)
+
+        _signal_installed = True
+
+    except ValueError:
+        # Only the main thread can install handlers; the trigger file still works
+        logger.debug('Not in main thread. Profiling signal handler not installed.')
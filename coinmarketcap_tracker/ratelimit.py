@@ -0,0 +1,228 @@
+import contextlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+from .clock import system_clock
+from .metrics import metrics
+
+try:
+    import fcntl
+
+except ImportError:
+    fcntl = None    # No cross-process coordination without flock (e.g. Windows)
+
+logger = logging.getLogger(__name__)
+
+# metadata.error messages worth retrying: rate limiting, server-side (5xx) failures and timeouts.
+# Anything else (unknown currency, invalid convert, bad parameters) fails the same way every time.
+transient_error_pattern = re.compile(r'\b(429|5\d\d)\b|rate.?limit|too many requests|timed? ?out|temporar|unavailable|server error|try again',
+                                     re.IGNORECASE)
+
+
+def is_transient_error(error):
+    return transient_error_pattern.search(str(error)) != None
+
+
+class TokenBucket:
+    # Allows bursts of up to capacity requests and a sustained rate of rate requests per second.
+    #
+    # With state_file set, the bucket state lives in that file and is updated under an exclusive
+    # flock, so every process pointing at the same file draws from one shared budget.
+
+
+    def __init__(self, rate, capacity, state_file=None, clock=None):
+        self.rate = rate
+
+        self.clock = clock if clock != None else system_clock
+
+        self.capacity = capacity
+
+        self.state_file = state_file if fcntl != None else None
+
+        if state_file != None and fcntl == None:
+            logger.warning('fcntl unavailable. Rate limit state for %s is per-process only.', state_file)
+
+        self.tokens = capacity
+
+        self.updated = self.clock.monotonic()
+
+        self.lock = threading.Lock()
+
+
+    @contextlib.contextmanager
+    def locked_state(self):
+        with self.lock:
+            if self.state_file == None:
+                state = {'tokens': self.tokens, 'updated': self.updated}
+
+                yield state, self.clock.monotonic()
+
+                self.tokens = state['tokens']
+                self.updated = state['updated']
+
+                return
+
+            # Wall clock here since the timestamp is shared between processes
+            with open(self.state_file, 'a+', encoding='utf-8') as file:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+
+                try:
+                    file.seek(0)
+
+                    try:
+                        state = json.loads(file.read())
+
+                    except ValueError:
+                        state = {'tokens': self.capacity, 'updated': self.clock.time()}
+
+                    yield state, self.clock.time()
+
+                    file.seek(0)
+                    file.truncate()
+                    file.write(json.dumps(state))
+                    file.flush()
+
+                finally:
+                    fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+    def try_acquire(self):
+        # Takes a token and returns 0, or returns the seconds until one will be available
+        with self.locked_state() as (state, now):
+            state['tokens'] = min(self.capacity, state['tokens'] + (now - state['updated']) * self.rate)
+            state['updated'] = now
+
+            if state['tokens'] >= 1:
+                state['tokens'] -= 1
+
+                return 0
+
+            return (1 - state['tokens']) / self.rate
+
+
+    def acquire(self, sleep=None):
+        # Returns the total seconds spent waiting for a token
+        if sleep == None:
+            sleep = self.clock.sleep
+
+        waited = 0.0
+
+        while True:
+            wait_time = self.try_acquire()
+
+            if wait_time == 0:
+                return waited
+
+            logger.debug('Rate limit reached. Waiting %.2f seconds.', wait_time)
+
+            sleep(wait_time)
+
+            waited += wait_time
+
+
+class RequestGovernor:
+    # Central gate for Coinmarketcap requests: every call takes a token from the global bucket
+    # and from its endpoint's bucket (if one is configured), and failures are retried with
+    # exponential backoff and full jitter. Exceptions are retried, as are responses whose metadata
+    # error retry_error() considers transient (is_transient_error by default); other errors are
+    # returned right away so permanent failures do not use up the request budget. Time spent waiting for tokens or backing off is recorded in
+    # tracker_governor_wait_seconds, so it is not mistaken for Coinmarketcap latency.
+
+
+    def __init__(self, rate=0.5, capacity=10, endpoint_budgets=None, max_retries=3,
+                 backoff_base=2.0, backoff_max=60.0, state_directory=None, sleep=None, retry_error=is_transient_error, clock=None):
+        # Kept so with_clock() can build the same governor on another clock
+        self.options = {'rate': rate, 'capacity': capacity, 'endpoint_budgets': endpoint_budgets, 'max_retries': max_retries,
+                        'backoff_base': backoff_base, 'backoff_max': backoff_max, 'retry_error': retry_error}
+
+        self.clock = clock if clock != None else system_clock
+
+        if state_directory != None:
+            os.makedirs(state_directory, exist_ok=True)
+
+        def state_file(name):
+            if state_directory == None:
+                return None
+
+            return os.path.join(state_directory, 'ratelimit_' + name + '.json')
+
+        self.bucket = TokenBucket(rate, capacity, state_file=state_file('global'), clock=self.clock)
+
+        # endpoint_budgets: {'ticker': (rate, capacity), ...}
+        self.endpoint_buckets = {}
+
+        for endpoint, (endpoint_rate, endpoint_capacity) in (endpoint_budgets or {}).items():
+            self.endpoint_buckets[endpoint] = TokenBucket(endpoint_rate, endpoint_capacity, state_file=state_file(endpoint), clock=self.clock)
+
+        self.max_retries = max_retries
+
+        self.backoff_base = backoff_base
+
+        self.backoff_max = backoff_max
+
+        self.sleep = sleep if sleep != None else self.clock.sleep
+
+        self.retry_error = retry_error
+
+
+    def with_clock(self, clock):
+        # Same budget and retry settings on another clock (e.g. a SimulatedClock). The shared state
+        # directory is left out: its timestamps are wall time and shared with real trackers.
+        return RequestGovernor(clock=clock, **self.options)
+
+
+    def acquire(self, endpoint):
+        waited = 0.0
+
+        if endpoint in self.endpoint_buckets:
+            waited += self.endpoint_buckets[endpoint].acquire(sleep=self.sleep)
+
+        waited += self.bucket.acquire(sleep=self.sleep)
+
+        metrics.observe('tracker_governor_wait_seconds', waited, endpoint=endpoint, reason='rate_limit')
+
+
+    def backoff_delay(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+
+    def call(self, endpoint, func, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self.acquire(endpoint)
+
+            try:
+                response = func(*args, **kwargs)
+
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+
+                logger.warning('Exception from %s request (attempt %s of %s): %s', endpoint, attempt + 1, self.max_retries + 1, e)
+
+            else:
+                error = None
+
+                if isinstance(response, dict):
+                    error = response.get('metadata', {}).get('error')
+
+                if error == None or attempt == self.max_retries:
+                    return response
+
+                if self.retry_error(error) == False:
+                    logger.debug('Not retrying %s request after permanent error: %s', endpoint, error)
+
+                    return response
+
+                logger.warning('Error in %s response metadata (attempt %s of %s): %s', endpoint, attempt + 1, self.max_retries + 1, error)
+
+            delay = self.backoff_delay(attempt)
+            logger.debug('Retrying %s request in %.2f seconds.', endpoint, delay)
+
+            self.sleep(delay)
+
+            metrics.observe('tracker_governor_wait_seconds', delay, endpoint=endpoint, reason='backoff')
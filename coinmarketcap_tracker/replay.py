@@ -0,0 +1,190 @@
+import argparse
+import concurrent.futures
+import itertools
+import json
+import logging
+import os
+import time
+import zlib
+
+from .clock import SimulatedClock
+from .coinmarketcap_tracker import TrackProduct
+from .logconfig import configure_logging
+from .runarchive import ArchiveReader
+from .runarchive import extension as archive_extension
+from .storage import JsonLinesStorage
+
+logger = logging.getLogger(__name__)
+
+# Feeds archived tracker data back through TrackProduct (change detection, running stats, Slack
+# formatting, persistence and final results) as fast as the pipeline allows. Each replay runs on
+# its own SimulatedClock set to the recorded timestamps, so interval-based behaviour (Slack alert
+# spacing, remaining time) matches the original run.
+
+
+def iter_archive_records(path):
+    # Streams records from historical_data*.json, .jsonl or compressed runarchive files
+    if path.endswith(archive_extension):
+        with ArchiveReader(path) as reader:
+            for record in reader:
+                yield record
+
+    elif path.endswith('.jsonl'):
+        for record in JsonLinesStorage(path).iter_records():
+            yield record
+
+    else:
+        # A json array has to be parsed whole
+        with open(path, 'r', encoding='utf-8') as file:
+            records = json.load(file)
+
+        for record in records:
+            yield record
+
+
+def iter_mongo_records(collection, doc_id, samples_collection=None):
+    # Tickers of one run document, from results.data ('embedded') or its samples collection ('timeseries')
+    if samples_collection != None:
+        for sample in samples_collection.find({'meta.run_id': doc_id}).sort('timestamp', 1):
+            yield sample['ticker']
+
+    else:
+        run_document = collection.find_one({'_id': doc_id}, {'results.data': True})
+
+        for record in run_document['results']['data']:
+            yield record
+
+
+def archive_time_range(path):
+    # (first, last) timestamp without reading the records, where the format allows it
+    if path.endswith(archive_extension):
+        with ArchiveReader(path) as reader:
+            timestamps = [block[4] for block in reader.blocks if block[4] != None] + [block[5] for block in reader.blocks if block[5] != None]
+
+            if timestamps != []:
+                return min(timestamps), max(timestamps)
+
+    return None
+
+
+def market_from_record(record):
+    quote_products = [quote_product for quote_product in record['data']['quotes'] if quote_product != 'USD']
+
+    return record['data']['symbol'] + '/' + (quote_products[0] if quote_products != [] else 'USD')
+
+
+def replay_records(records, json_directory, market=None, tracking_duration=None, slack_channel=None, **tracker_options):
+    # Runs one stream of records through a fresh TrackProduct and returns a summary of the replay
+    records = iter(records)
+
+    replay_start = time.time()
+
+    try:
+        first_record = next(records)
+
+    except StopIteration:
+        return {'market': market, 'samples': 0, 'updates': 0, 'results': None, 'seconds': 0.0}
+
+    if market == None:
+        market = market_from_record(first_record)
+
+    if tracking_duration == None:
+        tracking_duration = 24    # Unknown until the stream ends; only used for the end time shown in messages
+
+    clock = SimulatedClock(start=first_record['metadata']['timestamp'])
+
+    tracker = TrackProduct(json_directory=json_directory, clock=clock, **tracker_options)
+
+    tracker.set_parameters(market=market, tracking_duration=tracking_duration, slack_channel=slack_channel, validate_market=False)
+
+    if tracker.start_tracking(cmc_data=first_record) == False:
+        logger.warning('Skipping replay of %s: first record has no valid price.', market)
+
+        return {'market': market, 'samples': 0, 'updates': 0, 'results': None, 'seconds': time.time() - replay_start}
+
+    samples = 0
+
+    for record in itertools.chain([first_record], records):
+        clock.advance_to(record['metadata']['timestamp'])
+
+        tracker.process_ticker(record)
+
+        samples += 1
+
+    tracker.finish_tracking()
+
+    if tracker.slack_dispatcher != None:
+        tracker.slack_dispatcher.flush(timeout=60)
+
+    return {'market': market, 'samples': samples, 'updates': tracker.update_count,
+            'results': tracker.market_stats.summary(), 'seconds': time.time() - replay_start}
+
+
+def replay_file(path, json_directory='json/replay/', **tracker_options):
+    # Output goes to a directory per source file, so replays of the same market never share files
+    if json_directory[-1] != '/':
+        json_directory += '/'
+
+    run_directory = json_directory + os.path.basename(path).split('.')[0] + '_' + '{:08x}'.format(zlib.crc32(os.path.abspath(path).encode('utf-8'))) + '/'
+
+    time_range = archive_time_range(path)
+
+    if time_range != None and 'tracking_duration' not in tracker_options:
+        tracker_options['tracking_duration'] = (time_range[1] - time_range[0]) / 3600
+
+    summary = replay_records(iter_archive_records(path), run_directory, **tracker_options)
+
+    summary['path'] = path
+
+    logger.info('Replayed %s sample(s) from %s in %.2f seconds.', summary['samples'], path, summary['seconds'])
+
+    return summary
+
+
+def replay_files(paths, json_directory='json/replay/', processes=None, **tracker_options):
+    # Replays files in parallel worker processes (one TrackProduct per file). tracker_options must be picklable.
+    summaries = []
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {executor.submit(replay_file, path, json_directory, **tracker_options): path for path in paths}
+
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                summaries.append(future.result())
+
+            except Exception as e:
+                logger.exception('Exception while replaying %s.', futures[future])
+                logger.exception(e)
+
+                summaries.append({'path': futures[future], 'error': str(e)})
+
+    return sorted(summaries, key=lambda summary: summary['path'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay archived tracker data through TrackProduct.')
+
+    parser.add_argument('paths', nargs='+', help='historical_data*.json, .jsonl or ' + archive_extension + ' files')
+    parser.add_argument('--directory', default='json/replay/', help='Output directory for replayed runs')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--storage-format', choices=('json', 'jsonl'), default='jsonl')
+    parser.add_argument('--fsync-policy', choices=('always', 'group', 'never'), default='never')
+
+    args = parser.parse_args(argv)
+
+    configure_logging(level=logging.WARNING)
+
+    replay_start = time.time()
+
+    summaries = replay_files(args.paths, args.directory, processes=args.processes,
+                             storage_format=args.storage_format, fsync_policy=args.fsync_policy, keep_series=False)
+
+    samples = sum(summary.get('samples', 0) for summary in summaries)
+
+    print(json.dumps(summaries, indent=4, sort_keys=True, default=str))
+
+    print('Replayed %s sample(s) from %s file(s) in %.2f seconds.' % (samples, len(summaries), time.time() - replay_start))
+
+
+if __name__ == '__main__':
+    main()
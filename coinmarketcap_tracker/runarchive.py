@@ -0,0 +1,299 @@
+import bisect
+import gzip
+import json
+import logging
+import struct
+
+from .atomicfile import check_fsync_policy, commit_file, discard_file, temp_path_for
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Layout: header (magic, byte offset of the index), then independently compressed blocks of
+# compact json lines, then the json index listing each block's offset, length, first record
+# number and timestamp range. Any record or time range can be read by decompressing only the
+# blocks that hold it.
+magic = b'CMCZARC1'
+
+header_format = '<8sQ'
+
+header_size = struct.calcsize(header_format)
+
+extension = '.cmcz'
+
+
+def default_codec():
+    return 'zstd' if zstandard != None else 'gzip'
+
+
+def compress(data, codec, level=None):
+    if codec == 'zstd':
+        if zstandard == None:
+            raise ImportError('zstandard is required for the zstd archive codec.')
+
+        return zstandard.ZstdCompressor(level=level if level != None else 10).compress(data)
+
+    if codec == 'gzip':
+        return gzip.compress(data, compresslevel=level if level != None else 9)
+
+    raise ValueError('Unknown archive codec "' + str(codec) + '". Valid codecs: gzip, zstd')
+
+
+def decompress(data, codec):
+    if codec == 'zstd':
+        if zstandard == None:
+            raise ImportError('zstandard is required to read zstd archives.')
+
+        return zstandard.ZstdDecompressor().decompress(data)
+
+    return gzip.decompress(data)
+
+
+def record_timestamp(record):
+    return record.get('metadata', {}).get('timestamp')
+
+
+class ArchiveWriter:
+    # Streams records into a block-compressed archive. The file only appears at path once
+    # close() has written the index.
+
+
+    def __init__(self, path, codec=None, block_records=256, level=None, metadata=None, fsync='always'):
+        check_fsync_policy(fsync)
+
+        self.path = path
+
+        self.codec = codec if codec != None else default_codec()
+
+        self.block_records = block_records
+
+        self.level = level
+
+        self.metadata = metadata if metadata != None else {}
+
+        self.fsync = fsync
+
+        self.temp_path = temp_path_for(path)
+
+        self.file = open(self.temp_path, 'wb')
+
+        self.file.write(struct.pack(header_format, magic, 0))
+
+        self.blocks = []    # [offset, length, first record number, record count, min timestamp, max timestamp]
+
+        self.count = 0
+
+        self.block = []
+
+
+    def append(self, record):
+        self.block.append(record)
+
+        if len(self.block) >= self.block_records:
+            self.write_block()
+
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+
+    def write_block(self):
+        if self.block == []:
+            return
+
+        data = compress(''.join(json.dumps(record, sort_keys=True, ensure_ascii=False, separators=(',', ':')) + '\n' for record in self.block).encode('utf-8'),
+                        self.codec, self.level)
+
+        timestamps = [timestamp for timestamp in map(record_timestamp, self.block) if timestamp != None]
+
+        self.blocks.append([self.file.tell(), len(data), self.count, len(self.block),
+                            min(timestamps) if timestamps != [] else None, max(timestamps) if timestamps != [] else None])
+
+        self.file.write(data)
+
+        self.count += len(self.block)
+
+        self.block = []
+
+
+    def close(self):
+        if self.file == None:
+            return
+
+        try:
+            self.write_block()
+
+            index_offset = self.file.tell()
+
+            index = {'version': 1, 'codec': self.codec, 'count': self.count, 'blocks': self.blocks, 'metadata': self.metadata}
+
+            self.file.write(json.dumps(index, sort_keys=True, separators=(',', ':')).encode('utf-8'))
+
+            self.file.seek(0)
+
+            self.file.write(struct.pack(header_format, magic, index_offset))
+
+            commit_file(self.file, self.temp_path, self.path, self.fsync)
+
+        except BaseException:
+            discard_file(self.file, self.temp_path)
+
+            raise
+
+        finally:
+            self.file = None
+
+
+    def abort(self):
+        if self.file != None:
+            discard_file(self.file, self.temp_path)
+
+            self.file = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type == None:
+            self.close()
+
+        else:
+            self.abort()
+
+
+class ArchiveReader:
+    # Random access and streaming over an archive written by ArchiveWriter. Only the index is
+    # read up front; blocks are decompressed on demand and the most recent one is kept.
+
+
+    def __init__(self, path):
+        self.path = path
+
+        self.file = open(path, 'rb')
+
+        file_magic, index_offset = struct.unpack(header_format, self.file.read(header_size))
+
+        if file_magic != magic:
+            self.file.close()
+
+            raise ValueError(path + ' is not a Coinmarketcap tracker archive.')
+
+        self.file.seek(index_offset)
+
+        self.index = json.loads(self.file.read().decode('utf-8'))
+
+        self.codec = self.index['codec']
+
+        self.blocks = self.index['blocks']
+
+        self.metadata = self.index['metadata']
+
+        self.block_starts = [block[2] for block in self.blocks]
+
+        self.cached_block = (None, None)
+
+
+    def __len__(self):
+        return self.index['count']
+
+
+    def read_block(self, block_number):
+        if self.cached_block[0] == block_number:
+            return self.cached_block[1]
+
+        offset, length = self.blocks[block_number][:2]
+
+        self.file.seek(offset)
+
+        records = [json.loads(line) for line in decompress(self.file.read(length), self.codec).decode('utf-8').splitlines()]
+
+        self.cached_block = (block_number, records)
+
+        return records
+
+
+    def get(self, record_number):
+        if record_number < 0:
+            record_number += len(self)
+
+        if record_number < 0 or record_number >= len(self):
+            raise IndexError('archive record ' + str(record_number) + ' out of range')
+
+        block_number = bisect.bisect_right(self.block_starts, record_number) - 1
+
+        return self.read_block(block_number)[record_number - self.block_starts[block_number]]
+
+
+    def __getitem__(self, record_number):
+        return self.get(record_number)
+
+
+    def iter_records(self, start=0, stop=None):
+        if stop == None or stop > len(self):
+            stop = len(self)
+
+        if start >= stop:
+            return
+
+        for block_number in range(bisect.bisect_right(self.block_starts, start) - 1, len(self.blocks)):
+            block_start = self.block_starts[block_number]
+
+            if block_start >= stop:
+                return
+
+            for position, record in enumerate(self.read_block(block_number), start=block_start):
+                if start <= position < stop:
+                    yield record
+
+
+    def __iter__(self):
+        return self.iter_records()
+
+
+    def iter_range(self, timestamp_start=None, timestamp_end=None):
+        # Records with timestamp_start <= metadata.timestamp <= timestamp_end; blocks entirely outside are never read
+        for block_number, block in enumerate(self.blocks):
+            block_min, block_max = block[4], block[5]
+
+            if block_min == None:
+                continue
+
+            if (timestamp_start != None and block_max < timestamp_start) or (timestamp_end != None and block_min > timestamp_end):
+                continue
+
+            for record in self.read_block(block_number):
+                timestamp = record_timestamp(record)
+
+                if timestamp == None:
+                    continue
+
+                if (timestamp_start == None or timestamp >= timestamp_start) and (timestamp_end == None or timestamp <= timestamp_end):
+                    yield record
+
+
+    def close(self):
+        self.file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def write_archive(records, path, codec=None, block_records=256, level=None, metadata=None, fsync='always'):
+    with ArchiveWriter(path, codec=codec, block_records=block_records, level=level, metadata=metadata, fsync=fsync) as writer:
+        writer.extend(records)
+
+    logger.debug('Archived %s record(s) to %s (%s).', writer.count, path, writer.codec)
+
+    return writer.count
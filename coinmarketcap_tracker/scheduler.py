@@ -0,0 +1,186 @@
+import logging
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+class TickScheduler:
+    # Fixed-rate schedule on a monotonic clock. Tick n is due at origin + offset + n * period, so
+    # time spent fetching/persisting does not push later ticks back. A tick that is overrun by
+    # less than a period runs late; whole periods that were missed are skipped and coalesced into
+    # a single immediate tick.
+    #
+    # The offset is derived from key (e.g. the market name) so trackers started together spread
+    # over jitter * period instead of all polling at the same instant, and keep the same slot
+    # across restarts.
+
+
+    def __init__(self, period, key=None, jitter=0.0, clock=time.monotonic, sleep=time.sleep):
+        self.period = period
+
+        self.clock = clock
+
+        self.sleep = sleep
+
+        if key != None and jitter > 0:
+            self.offset = (zlib.crc32(str(key).encode('utf-8')) % 10000) / 10000 * min(jitter, 1.0) * period
+
+        else:
+            self.offset = 0.0
+
+        self.origin = None
+
+        self.tick_index = 0
+
+        self.skipped = 0
+
+        self.lateness = 0.0    # How late the most recent tick was relative to its deadline
+
+
+    def next_delay(self):
+        # Seconds to wait before the next tick (0 if already due). Advances the schedule.
+        now = self.clock()
+
+        if self.origin == None:
+            self.origin = now
+
+        deadline = self.origin + self.offset + self.tick_index * self.period
+
+        if now >= deadline + self.period:
+            missed = int((now - deadline) / self.period)
+
+            logger.warning('Schedule overrun. Skipping %s missed tick(s).', missed)
+
+            self.skipped += missed
+
+            self.tick_index += missed
+
+            deadline += missed * self.period
+
+        self.tick_index += 1
+
+        self.lateness = max(now - deadline, 0.0)
+
+        return max(deadline - now, 0.0)
+
+
+    def wait(self):
+        delay = self.next_delay()
+
+        if delay > 0:
+            logger.debug('Sleeping for %.2f seconds.', delay)
+
+            self.sleep(delay)
+
+
+class AdaptivePoller:
+    # Polls just after the ticker is expected to refresh instead of on a fixed period. The update
+    # cadence is learned from the deltas between successive last_updated values (exponentially
+    # weighted), and polling backs off geometrically while the ticker is unchanged or failing.
+    # Until the first delta is seen, polling runs at min_interval so no refresh is missed and the
+    # first cadence sample is exact. Same next_delay()/wait() interface as TickScheduler.
+
+
+    def __init__(self, default_interval, min_interval=30, max_interval=None, margin=15,
+                 backoff_factor=2.0, smoothing=0.3, clock=time.time, sleep=time.sleep):
+        self.default_interval = default_interval    # Cadence assumed until one has been observed
+
+        self.min_interval = min_interval
+
+        self.max_interval = max_interval if max_interval != None else default_interval
+
+        self.margin = margin    # Seconds after the expected refresh to poll
+
+        self.backoff_factor = backoff_factor
+
+        self.smoothing = smoothing
+
+        self.clock = clock    # Wall clock, since last_updated is a unix timestamp
+
+        self.sleep = sleep
+
+        self.cadence = None
+
+        self.last_updated = None
+
+        self.backoff = min_interval    # Next backoff delay; only backoff_delay() grows it
+
+        self.pending_delay = 0.0    # None once used, until observe() sets the next one
+
+        # No fixed deadlines, so ticks are never late or skipped (kept for parity with TickScheduler)
+        self.lateness = 0.0
+
+        self.skipped = 0
+
+
+    def observe(self, last_updated):
+        if self.cadence == None and (self.last_updated == None or last_updated <= self.last_updated):
+            self.last_updated = last_updated
+
+            self.pending_delay = self.min_interval
+
+            self.backoff = self.min_interval
+
+            return
+
+        if last_updated <= self.last_updated:
+            self.pending_delay = self.backoff_delay()
+
+            logger.debug('Ticker unchanged. Backing off %.2f seconds.', self.pending_delay)
+
+            return
+
+        delta = last_updated - self.last_updated
+
+        if self.cadence == None:
+            self.cadence = delta
+
+        else:
+            # A delta spanning several refreshes means polls were missed, not that the cadence slowed
+            delta = delta / max(round(delta / self.cadence), 1)
+
+            self.cadence += self.smoothing * (delta - self.cadence)
+
+        logger.debug('Learned update cadence: %.2f seconds.', self.cadence)
+
+        self.last_updated = last_updated
+
+        self.backoff = self.min_interval
+
+        delay = (last_updated + self.cadence + self.margin) - self.clock()
+
+        # Expected refresh already passed (or clock skew), check again soon
+        if delay <= 0:
+            delay = self.min_interval
+
+        self.pending_delay = min(max(delay, self.min_interval), self.max_interval)
+
+
+    def backoff_delay(self):
+        delay = min(self.backoff, self.max_interval)
+
+        self.backoff *= self.backoff_factor
+
+        return delay
+
+
+    def next_delay(self):
+        delay = self.pending_delay
+
+        # Nothing observed since the last call (e.g. the fetch failed): back off
+        if delay == None:
+            delay = self.backoff_delay()
+
+        self.pending_delay = None
+
+        return delay
+
+
+    def wait(self):
+        delay = self.next_delay()
+
+        if delay > 0:
+            logger.debug('Sleeping for %.2f seconds.', delay)
+
+            self.sleep(delay)
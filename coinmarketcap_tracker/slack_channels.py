@@ -0,0 +1,111 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from .atomicfile import atomic_write
+
+logger = logging.getLogger(__name__)
+
+
+class ChannelCache:
+    # Slack channel name -> ID map shared by all trackers in a process, persisted to cache_file so
+    # restarts and other tracker processes skip the lookup. Entries expire after ttl seconds in
+    # case a channel is renamed or recreated.
+
+
+    def __init__(self, cache_file=None, ttl=86400):
+        self.cache_file = cache_file
+
+        self.ttl = ttl
+
+        self.entries = {}    # name -> [channel id, resolved time]
+
+        self.lock = threading.Lock()
+
+        if self.cache_file != None and os.path.exists(self.cache_file):
+            try:
+                with open(self.cache_file, 'r', encoding='utf-8') as file:
+                    self.entries = json.load(file)
+
+            except (OSError, ValueError):
+                logger.warning('Ignoring unreadable Slack channel cache %s.', self.cache_file)
+
+
+    def get(self, name):
+        with self.lock:
+            entry = self.entries.get(name)
+
+        if entry == None or time.time() - entry[1] > self.ttl:
+            return None
+
+        return entry[0]
+
+
+    def set(self, name, channel_id):
+        with self.lock:
+            self.entries[name] = [channel_id, time.time()]
+
+            if self.cache_file != None:
+                try:
+                    atomic_write(self.cache_file, json.dumps(self.entries, indent=4, sort_keys=True))
+
+                except OSError as e:
+                    logger.warning('Failed to write Slack channel cache %s: %s', self.cache_file, e)
+
+
+def find_channel_id(slack_client, name, page_limit=200):
+    # Pages through conversations.list and stops at the first match
+    cursor = None
+
+    while True:
+        response = slack_client.api_call('conversations.list', types='public_channel,private_channel',
+                                         exclude_archived=True, limit=page_limit, cursor=cursor)
+
+        if not response.get('ok'):
+            logger.warning('conversations.list failed (%s). Falling back to channels.list/groups.list.', response.get('error'))
+
+            return find_channel_id_legacy(slack_client, name)
+
+        for channel in response['channels']:
+            if channel['name'] == name:
+                return channel['id']
+
+        cursor = response.get('response_metadata', {}).get('next_cursor')
+
+        if not cursor:
+            return None
+
+
+def find_channel_id_legacy(slack_client, name):
+    for method, key in (('channels.list', 'channels'), ('groups.list', 'groups')):
+        response = slack_client.api_call(method, exclude_members=True)
+
+        if not response.get('ok'):
+            logger.error('%s API call failed: %s', method, response.get('error'))
+
+            continue
+
+        for channel in response[key]:
+            if channel['name'] == name:
+                return channel['id']
+
+    return None
+
+
+def resolve_channel_id(slack_client, name, channel_cache=None):
+    if channel_cache != None:
+        channel_id = channel_cache.get(name)
+
+        if channel_id != None:
+            logger.debug('Slack channel #%s resolved from cache.', name)
+
+            return channel_id
+
+    channel_id = find_channel_id(slack_client, name)
+
+    if channel_id != None and channel_cache != None:
+        channel_cache.set(name, channel_id)
+
+    return channel_id
@@ -0,0 +1,220 @@
+import atexit
+import collections
+import logging
+import os
+import threading
+import time
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SlackThread:
+    # Placeholder for a thread whose ts is only known once its first message has been posted.
+    # Messages queued behind that first message can reference the handle and are posted as
+    # replies once it resolves.
+
+
+    def __init__(self, ts=None):
+        self.ts = ts
+
+
+    def set_from_result(self, result):
+        if result != None and result.get('ok'):
+            self.ts = result['message']['ts']
+
+
+class PendingMessage:
+    __slots__ = ('slack_client', 'channel_id', 'parts', 'thread', 'coalesce', 'on_result', 'post_args', 'attempts')
+
+
+    def __init__(self, slack_client, channel_id, message, thread, coalesce, source, on_result, post_args):
+        self.slack_client = slack_client
+
+        self.channel_id = channel_id
+
+        self.parts = collections.OrderedDict([(source, message)])
+
+        self.thread = thread
+
+        self.coalesce = coalesce
+
+        self.on_result = on_result
+
+        self.post_args = post_args
+
+        self.attempts = 0
+
+
+class SlackDispatcher:
+    # Posts chat.postMessage calls from a background thread so trackers never block on Slack.
+    #
+    # Messages are queued per channel and each channel is limited to one post per
+    # channel_interval seconds (Slack's per-channel limit). A 'ratelimited' response pauses that
+    # channel for the Retry-After period and the message is retried. Coalescing messages queued
+    # for the same thread are merged: a newer update from the same source replaces the older
+    # one, and updates from different sources are joined into one post.
+
+
+    def __init__(self, channel_interval=1.0, max_attempts=5, default_retry_after=1.0):
+        self.channel_interval = channel_interval
+
+        self.max_attempts = max_attempts
+
+        self.default_retry_after = default_retry_after
+
+        self.channels = {}    # channel id -> deque of PendingMessage
+
+        self.next_allowed = {}    # channel id -> monotonic time of next permitted post
+
+        self.in_flight = 0
+
+        self.condition = threading.Condition()
+
+        self.thread = None
+
+
+    def submit(self, slack_client, channel_id, message, thread=None, coalesce=False, source=None, on_result=None, **post_args):
+        with self.condition:
+            channel_queue = self.channels.setdefault(channel_id, collections.deque())
+
+            if coalesce == True:
+                for pending in channel_queue:
+                    if pending.coalesce == True and pending.thread == thread and pending.slack_client is slack_client:
+                        pending.parts[source] = message
+
+                        return
+
+            channel_queue.append(PendingMessage(slack_client, channel_id, message, thread, coalesce, source, on_result, post_args))
+
+            if self.thread == None:
+                self.thread = threading.Thread(target=self.run, name='slack-dispatcher', daemon=True)
+
+                self.thread.start()
+
+            self.condition.notify_all()
+
+
+    def next_message(self):
+        with self.condition:
+            while True:
+                ready = [(self.next_allowed.get(channel_id, 0), channel_id) for channel_id, channel_queue in self.channels.items() if len(channel_queue) > 0]
+
+                if ready == []:
+                    self.condition.wait()
+
+                    continue
+
+                allowed_at, channel_id = min(ready)
+
+                wait_time = allowed_at - time.monotonic()
+
+                if wait_time > 0:
+                    self.condition.wait(wait_time)
+
+                    continue
+
+                self.in_flight += 1
+
+                return self.channels[channel_id].popleft()
+
+
+    def post(self, pending):
+        thread_ts = pending.thread.ts if isinstance(pending.thread, SlackThread) else pending.thread
+
+        try:
+            with metrics.timer('tracker_slack_post_seconds', channel=pending.channel_id):
+                return pending.slack_client.api_call('chat.postMessage', channel=pending.channel_id,
+                                                     text='\n\n'.join(pending.parts.values()),
+                                                     thread_ts=thread_ts, **pending.post_args)
+
+        except Exception as e:
+            logger.exception('Exception while sending Slack alert.')
+            logger.exception(e)
+
+            return None
+
+
+    def run(self):
+        while True:
+            pending = self.next_message()
+
+            result = self.post(pending)
+
+            pending.attempts += 1
+
+            retry_after = None
+
+            if result == None:
+                retry_after = self.default_retry_after * 2 ** (pending.attempts - 1)
+
+            elif result.get('ok') == False and result.get('error') == 'ratelimited':
+                retry_after = float(result.get('headers', {}).get('Retry-After', self.default_retry_after))
+
+                logger.warning('Slack rate limited channel %s. Retrying in %s seconds.', pending.channel_id, retry_after)
+
+            retry = retry_after != None and pending.attempts < self.max_attempts
+
+            with self.condition:
+                if retry == True:
+                    self.channels[pending.channel_id].appendleft(pending)
+
+                    self.next_allowed[pending.channel_id] = time.monotonic() + retry_after
+
+                else:
+                    self.next_allowed[pending.channel_id] = time.monotonic() + self.channel_interval
+
+                self.in_flight -= 1
+
+                self.condition.notify_all()
+
+            if retry == False:
+                if result == None or result.get('ok') == False:
+                    logger.error('Failed to send Slack alert to %s: %s', pending.channel_id, result)
+
+                if pending.on_result != None:
+                    try:
+                        pending.on_result(result)
+
+                    except Exception as e:
+                        logger.exception('Exception in Slack alert callback.')
+                        logger.exception(e)
+
+
+    def flush(self, timeout=None):
+        # Waits until every queued message has been posted (or given up on)
+        with self.condition:
+            return self.condition.wait_for(lambda: self.in_flight == 0 and all(len(channel_queue) == 0 for channel_queue in self.channels.values()),
+                                           timeout)
+
+
+_dispatcher = None
+
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    # One dispatcher per process so per-channel limits hold across every tracker
+    global _dispatcher
+
+    with _dispatcher_lock:
+        if _dispatcher == None:
+            _dispatcher = SlackDispatcher()
+
+            atexit.register(_dispatcher.flush, 30)
+
+        return _dispatcher
+
+
+def _reset_after_fork():
+    global _dispatcher, _dispatcher_lock
+
+    # The worker thread does not survive fork, so children start their own dispatcher
+    _dispatcher = None
+
+    _dispatcher_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
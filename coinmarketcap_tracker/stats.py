@@ -0,0 +1,144 @@
+import math
+
+
+class RunningStats:
+    # O(1) memory summary of a tracking run, updated once per archived ticker.
+    #
+    # Keeps first/last values for the original results, plus price min/max, mean and variance
+    # (Welford), a volume-weighted average price using volume_24h as the weight, and the
+    # largest peak-to-trough price drawdown.
+    #
+    # count is every archived ticker. Tickers without a usable price (None, NaN) still count and
+    # update timestamps, market cap and rank, but are left out of the price statistics; they are
+    # counted in price_missing and price_count holds the rest.
+
+    fields = ('count', 'price_count', 'price_missing', 'timestamp_first', 'timestamp_last', 'price_first', 'price_last', 'price_min', 'price_max',
+              'price_mean', 'price_m2', 'vwap_numerator', 'vwap_denominator', 'price_peak', 'max_drawdown',
+              'marketcap_first', 'marketcap_last', 'rank_first', 'rank_last')
+
+
+    def __init__(self, quote_product):
+        self.quote_product = quote_product
+
+        for field in RunningStats.fields:
+            setattr(self, field, None)
+
+        self.count = 0
+
+        self.price_count = 0
+
+        self.price_missing = 0
+
+
+    def update(self, cmc_data):
+        # Everything is read (and can raise) before any state changes, so a bad ticker leaves the stats untouched
+        quotes = cmc_data['data']['quotes'][self.quote_product]
+
+        price = quotes['price']
+
+        timestamp = cmc_data['metadata']['timestamp']
+
+        marketcap = quotes['market_cap']
+
+        rank = cmc_data['data']['rank']
+
+        volume = quotes.get('volume_24h') or 0
+
+        price_valid = valid_price(price)
+
+        self.count += 1
+
+        if self.count == 1:
+            self.timestamp_first = timestamp
+            self.marketcap_first = marketcap
+            self.rank_first = rank
+
+        self.timestamp_last = timestamp
+        self.marketcap_last = marketcap
+        self.rank_last = rank
+
+        if price_valid == False:
+            self.price_missing += 1
+
+            return
+
+        self.price_count += 1
+
+        if self.price_count == 1:
+            self.price_first = price
+
+            self.price_min = price
+            self.price_max = price
+            self.price_mean = 0.0
+            self.price_m2 = 0.0
+            self.vwap_numerator = 0.0
+            self.vwap_denominator = 0.0
+            self.price_peak = price
+            self.max_drawdown = 0.0
+
+        self.price_last = price
+
+        self.price_min = min(self.price_min, price)
+        self.price_max = max(self.price_max, price)
+
+        delta = price - self.price_mean
+        self.price_mean += delta / self.price_count
+        self.price_m2 += delta * (price - self.price_mean)
+
+        self.vwap_numerator += price * volume
+        self.vwap_denominator += volume
+
+        self.price_peak = max(self.price_peak, price)
+
+        if self.price_peak > 0:
+            self.max_drawdown = max(self.max_drawdown, (self.price_peak - price) / self.price_peak)
+
+
+    def price_variance(self):
+        if self.price_count < 2:
+            return 0.0
+
+        return self.price_m2 / (self.price_count - 1)
+
+
+    def price_vwap(self):
+        if not self.vwap_denominator:
+            return self.price_mean
+
+        return self.vwap_numerator / self.vwap_denominator
+
+
+    def summary(self):
+        return dict(sample_count=self.count, price_missing=self.price_missing, price_min=self.price_min, price_max=self.price_max,
+                    price_mean=self.price_mean, price_variance=self.price_variance(),
+                    price_stdev=math.sqrt(self.price_variance()), price_vwap=self.price_vwap(),
+                    max_drawdown_percent=self.max_drawdown * 100 if self.max_drawdown != None else None)
+
+
+    def to_dict(self):
+        state = {field: getattr(self, field) for field in RunningStats.fields}
+
+        state['quote_product'] = self.quote_product
+
+        return state
+
+
+    @classmethod
+    def from_dict(cls, state):
+        stats = cls(state['quote_product'])
+
+        for field in RunningStats.fields:
+            setattr(stats, field, state.get(field))
+
+        # Checkpoints written before price_count existed had a price for every ticker
+        if stats.price_count == None:
+            stats.price_count = stats.count
+
+        if stats.price_missing == None:
+            stats.price_missing = 0
+
+        return stats
+
+
+def valid_price(price):
+    return isinstance(price, (int, float)) and not isinstance(price, bool) and math.isfinite(price)
@@ -0,0 +1,266 @@
+import json
+import logging
+import os
+import textwrap
+import time
+
+from .atomicfile import atomic_write, check_fsync_policy, commit_file, discard_file, get_group_commit, temp_path_for
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class JsonArrayStorage:
+    # Original format: one pretty-printed json array, replaced atomically on every append. The
+    # existing array is streamed into the replacement file instead of being held in memory, so
+    # memory use does not grow with the run; each append still rewrites the whole file ('jsonl'
+    # avoids that).
+    extension = '.json'
+
+    copy_chunk_size = 1024 * 1024
+
+
+    def __init__(self, path, fsync='always'):
+        check_fsync_policy(fsync)
+
+        self.path = path
+
+        self.fsync = fsync    # See atomicfile.fsync_policies
+
+        self.record_count = 0
+
+
+    def load(self):
+        with open(self.path, 'r', encoding='utf-8') as file:
+            records = json.load(file)
+
+        self.record_count = len(records)
+
+        return records
+
+
+    def iter_records(self):
+        # A json array can only be parsed whole
+        with open(self.path, 'r', encoding='utf-8') as file:
+            return iter(json.load(file))
+
+
+    def initialize(self):
+        self.record_count = 0
+
+        with metrics.timer('tracker_storage_write_seconds', format='json'):
+            atomic_write(self.path, json.dumps([]), fsync=self.fsync)
+
+
+    def append(self, record):
+        self.append_many([record])
+
+
+    def append_many(self, records):
+        if records == []:
+            return
+
+        # Same text json.dumps(all_records, indent=4) would produce for these elements
+        elements = ',\n'.join(textwrap.indent(json.dumps(record, indent=4, sort_keys=True, ensure_ascii=False), '    ') for record in records)
+
+        with metrics.timer('tracker_storage_write_seconds', format='json'):
+            temp_path = temp_path_for(self.path)
+
+            file = open(temp_path, 'wb')
+
+            try:
+                self.copy_open_array(file)
+
+                file.write((elements + '\n]').encode('utf-8'))
+
+                # Replaced atomically, so a crash mid-write leaves the previous archive intact
+                commit_file(file, temp_path, self.path, self.fsync)
+
+            except BaseException:
+                discard_file(file, temp_path)
+
+                raise
+
+        self.record_count += len(records)
+
+
+    def copy_open_array(self, file):
+        # Writes the current array without its closing bracket, ready for more elements
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            file.write(b'[\n')
+
+            return
+
+        with open(self.path, 'rb') as source:
+            size = source.seek(0, os.SEEK_END)
+
+            source.seek(max(size - 2, 0))
+
+            tail = source.read()
+
+            if size > 2 and tail == b'\n]':
+                source.seek(0)
+
+                remaining = size - 2
+
+                while remaining > 0:
+                    chunk = source.read(min(self.copy_chunk_size, remaining))
+
+                    if not chunk:
+                        break
+
+                    file.write(chunk)
+
+                    remaining -= len(chunk)
+
+                file.write(b',\n')
+
+                return
+
+            # Empty array, or not in the layout written here (e.g. edited by hand): reformat once
+            source.seek(0)
+
+            records = json.loads(source.read().decode('utf-8'))
+
+        if records == []:
+            file.write(b'[\n')
+
+        else:
+            file.write((json.dumps(records, indent=4, sort_keys=True, ensure_ascii=False)[:-2] + ',\n').encode('utf-8'))
+
+
+    def resume(self):
+        # Appends stream the existing file, only the record count has to be restored
+        self.load()
+
+
+    def sync(self):
+        pass
+
+
+    def close(self):
+        pass
+
+
+class JsonLinesStorage:
+    # Append-only format: one compact json document per line, only the new record is written
+    extension = '.jsonl'
+
+
+    def __init__(self, path, fsync_records=10, fsync_seconds=60, fsync='always'):
+        check_fsync_policy(fsync)
+
+        self.path = path
+
+        self.fsync = fsync    # 'always' fsyncs on the schedule below, 'group' hands it to the shared GroupCommit, 'never' skips it
+
+        self.fsync_records = fsync_records    # Appends between fsyncs (0 or 1 = fsync every append)
+
+        self.fsync_seconds = fsync_seconds    # Max seconds an append can sit unsynced
+
+        self.file = None
+
+        self.unsynced_count = 0
+
+        self.fsync_last = time.time()
+
+
+    def iter_records(self):
+        with open(self.path, 'r', encoding='utf-8') as file:
+            for line_number, line in enumerate(file, start=1):
+                line = line.strip()
+
+                if line == '':
+                    continue
+
+                try:
+                    yield json.loads(line)
+
+                except ValueError:
+                    # A torn final line is expected after a crash mid-append
+                    logger.warning('Skipping unreadable record on line %s of %s.', line_number, self.path)
+
+
+    def load(self):
+        return list(self.iter_records())
+
+
+    def initialize(self):
+        self.close()
+
+        atomic_write(self.path, '', fsync=self.fsync)
+
+
+    def resume(self):
+        # Appends continue at the end of the existing file (open_for_append() handles a torn tail)
+        pass
+
+
+    def append(self, record):
+        self.append_many([record])
+
+
+    def append_many(self, records):
+        with metrics.timer('tracker_storage_write_seconds', format='jsonl'):
+            if self.file == None:
+                self.open_for_append()
+
+            self.file.write(''.join(json.dumps(record, sort_keys=True, ensure_ascii=False, separators=(',', ':')) + '\n' for record in records))
+
+            # Flush every write to the OS so a process crash loses nothing, fsync in batches
+            self.file.flush()
+
+            self.unsynced_count += len(records)
+
+            if self.unsynced_count >= max(self.fsync_records, 1) or (time.time() - self.fsync_last) > self.fsync_seconds:
+                self.sync()
+
+
+    def open_for_append(self):
+        torn_tail = False
+
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, 'rb') as file:
+                file.seek(-1, os.SEEK_END)
+
+                torn_tail = file.read(1) != b'\n'
+
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+        # Terminate a partially written line so it cannot corrupt the next record
+        if torn_tail == True:
+            self.file.write('\n')
+
+
+    def sync(self):
+        if self.file != None and self.unsynced_count > 0:
+            if self.fsync == 'always':
+                os.fsync(self.file.fileno())
+
+            elif self.fsync == 'group':
+                get_group_commit().add(self.path)
+
+        self.unsynced_count = 0
+
+        self.fsync_last = time.time()
+
+
+    def close(self):
+        if self.file != None:
+            self.sync()
+
+            self.file.close()
+
+            self.file = None
+
+
+storage_formats = {'json': JsonArrayStorage, 'jsonl': JsonLinesStorage}
+
+
+def open_storage(path_base, storage_format='json', **kwargs):
+    if storage_format not in storage_formats:
+        raise ValueError('Unknown storage format "' + str(storage_format) + '". Valid formats: ' + ', '.join(storage_formats))
+
+    storage_class = storage_formats[storage_format]
+
+    return storage_class(path_base + storage_class.extension, **kwargs)
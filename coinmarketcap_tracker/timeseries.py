@@ -0,0 +1,128 @@
+import array
+import math
+
+try:
+    import numpy
+
+except ImportError:
+    numpy = None
+
+
+class TickerSeries:
+    # Columnar store for one market's tickers: one typed array per field instead of one nested
+    # dict per sample (~100 bytes per sample rather than several kB). Missing values are NaN.
+    #
+    # to_dict()/from_dicts() convert to and from the Coinmarketcap ticker dict used elsewhere in
+    # the tracker. Only the quote product's quotes are kept, so other currencies in a ticker
+    # (e.g. the USD quotes included alongside a BTC conversion) are dropped.
+
+    __slots__ = ('quote_product', 'id', 'name', 'symbol', 'website_slug', 'columns')
+
+    data_columns = ('rank', 'circulating_supply', 'total_supply', 'max_supply', 'last_updated')
+
+    quote_columns = ('price', 'volume_24h', 'market_cap', 'percent_change_1h', 'percent_change_24h', 'percent_change_7d')
+
+    column_names = ('timestamp',) + data_columns + quote_columns
+
+
+    def __init__(self, quote_product):
+        self.quote_product = quote_product
+
+        self.id = None
+
+        self.name = None
+
+        self.symbol = None
+
+        self.website_slug = None
+
+        self.columns = {column: array.array('d') for column in TickerSeries.column_names}
+
+
+    def __len__(self):
+        return len(self.columns['timestamp'])
+
+
+    def append(self, cmc_data):
+        data = cmc_data['data']
+
+        quotes = data['quotes'][self.quote_product]
+
+        if self.id == None:
+            self.id = data.get('id')
+            self.name = data.get('name')
+            self.symbol = data.get('symbol')
+            self.website_slug = data.get('website_slug')
+
+        self.columns['timestamp'].append(to_float(cmc_data['metadata']['timestamp']))
+
+        for column in TickerSeries.data_columns:
+            self.columns[column].append(to_float(data.get(column)))
+
+        for column in TickerSeries.quote_columns:
+            self.columns[column].append(to_float(quotes.get(column)))
+
+
+    def extend(self, records):
+        for cmc_data in records:
+            self.append(cmc_data)
+
+
+    def column(self, name):
+        return self.columns[name]
+
+
+    def to_dict(self, index):
+        if index < 0:
+            index += len(self)
+
+        value = lambda column: from_float(self.columns[column][index])
+
+        data = {'id': self.id, 'name': self.name, 'symbol': self.symbol, 'website_slug': self.website_slug}
+
+        for column in TickerSeries.data_columns:
+            data[column] = value(column)
+
+        for column in ('rank', 'last_updated'):
+            if data[column] != None:
+                data[column] = int(data[column])
+
+        data['quotes'] = {self.quote_product: {column: value(column) for column in TickerSeries.quote_columns}}
+
+        return {'data': data, 'metadata': {'timestamp': int(self.columns['timestamp'][index]), 'error': None}}
+
+
+    def iter_dicts(self):
+        for index in range(len(self)):
+            yield self.to_dict(index)
+
+
+    def to_numpy(self):
+        if numpy == None:
+            raise ImportError('numpy is required for TickerSeries.to_numpy().')
+
+        # frombuffer shares memory with the arrays, no copy
+        return {column: numpy.frombuffer(self.columns[column], dtype=numpy.float64) for column in TickerSeries.column_names}
+
+
+    @classmethod
+    def from_dicts(cls, records, quote_product):
+        series = cls(quote_product)
+
+        series.extend(records)
+
+        return series
+
+
+def to_float(value):
+    if value == None:
+        return math.nan
+
+    return float(value)
+
+
+def from_float(value):
+    if math.isnan(value):
+        return None
+
+    return value
@@ -0,0 +1,155 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindWriter:
+    # Moves persistence off the polling path. submit() only enqueues; a background thread
+    # coalesces records and hands each batch to every sink (a callable taking a list of records)
+    # once flush_records have accumulated or the oldest pending record is flush_seconds old.
+    #
+    # The queue is bounded by max_pending, so if storage falls that far behind, submit() blocks
+    # rather than growing memory without limit. close() (also registered with atexit) drains
+    # and flushes everything still pending.
+    #
+    # after_written(callback) runs callback on the writer thread once every record submitted
+    # before it has been written (e.g. to save a checkpoint that must not get ahead of storage).
+
+
+    def __init__(self, sinks, flush_records=50, flush_seconds=30, max_pending=10000, name='write-behind'):
+        self.sinks = sinks
+
+        self.flush_records = flush_records
+
+        self.flush_seconds = flush_seconds
+
+        self.queue = queue.Queue(maxsize=max_pending)
+
+        self.closed = False
+
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+
+        self.thread.start()
+
+        atexit.register(self.close)
+
+
+    def submit(self, record):
+        try:
+            self.queue.put_nowait(('record', record))
+
+        except queue.Full:
+            logger.warning('Write-behind queue full. Waiting for storage to catch up.')
+
+            self.queue.put(('record', record))
+
+
+    def after_written(self, callback):
+        self.queue.put(('callback', callback))
+
+
+    def flush(self, timeout=None):
+        # Blocks until everything submitted so far has been written
+        done = threading.Event()
+
+        self.queue.put(('flush', done))
+
+        return done.wait(timeout)
+
+
+    def close(self, timeout=None):
+        if self.closed == True:
+            return
+
+        self.closed = True
+
+        self.queue.put(('stop', None))
+
+        self.thread.join(timeout)
+
+        atexit.unregister(self.close)
+
+
+    def run(self):
+        batch = []
+
+        batch_deadline = None
+
+        write_failed = False    # Since the last callback, which then must not claim the records were written
+
+        while True:
+            if batch == []:
+                timeout = None
+
+            else:
+                timeout = max(batch_deadline - time.monotonic(), 0)
+
+            try:
+                kind, item = self.queue.get(timeout=timeout)
+
+            except queue.Empty:
+                kind, item = 'timeout', None
+
+            if kind == 'record':
+                if batch == []:
+                    batch_deadline = time.monotonic() + self.flush_seconds
+
+                batch.append(item)
+
+                if len(batch) < self.flush_records:
+                    continue
+
+            if self.write_batch(batch) == False:
+                write_failed = True
+
+            batch = []
+
+            if kind == 'flush':
+                item.set()
+
+            elif kind == 'callback':
+                if write_failed == True:
+                    logger.warning('Skipping write-behind callback after a failed write.')
+
+                else:
+                    self.run_callback(item)
+
+                write_failed = False
+
+            elif kind == 'stop':
+                return
+
+
+    def write_batch(self, batch):
+        # Returns False if any sink failed
+        if batch == []:
+            return True
+
+        logger.debug('Writing batch of %s record(s).', len(batch))
+
+        written = True
+
+        for sink in self.sinks:
+            try:
+                sink(batch)
+
+            except Exception as e:
+                logger.exception('Exception while writing batch to %s.', sink)
+                logger.exception(e)
+
+                written = False
+
+        return written
+
+
+    def run_callback(self, callback):
+        try:
+            callback()
+
+        except Exception as e:
+            logger.exception('Exception in write-behind callback %s.', callback)
+            logger.exception(e)